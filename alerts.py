@@ -0,0 +1,125 @@
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from metrics import SENSOR_KEYS, build_long_frame, sensor_status
+from metrics_db import DB_PATH, connect
+from sensor_store import sensor_key
+from utils import send_mail
+
+
+# Checks whose state changes are alerted, columns of metrics.logger_metrics
+CHECKS = {
+    'battery': 'battery_status',
+    'updated': 'last_updated_status'
+}
+
+
+def battery_state(status):
+    # 'Latest value cannot be read - Latest readable value: 3100.0' changes with every reading, only its kind is a state
+    return status if status in ('OK', 'LOW', 'CRITICAL') else 'UNREADABLE'
+
+
+def sensor_states(store, metadata_logger, critical_limit, low_limit, odd_filenames=None, now=None):
+    """Current state of every check of every logger sensor, one row per (sensor, check_name) with state"""
+    now = now or datetime.today()
+
+    def sensor_frames():
+        for data_location, filename in zip(metadata_logger['data_location'], metadata_logger['filename']):
+            key = sensor_key(filename, odd_filenames)
+            if key is None:
+                continue
+            try:
+                yield key, store.get(data_location)
+            except Exception as e:
+                continue
+
+    # No value range rules, only the battery and the datetimes of every sensor are stacked
+    sensors, long_frame = build_long_frame(sensor_frames(), rules=[])
+    sensor_metrics = sensor_status(sensors, long_frame, critical_limit, low_limit, now)
+    sensor_metrics['battery_status'] = sensor_metrics['battery_status'].map(battery_state)
+    states = sensor_metrics.melt(id_vars=SENSOR_KEYS, value_vars=list(CHECKS.values()), var_name='check_name', value_name='state')
+    states['check_name'] = states['check_name'].map({v: k for k, v in CHECKS.items()})
+    return states
+
+
+def transitions(conn, states, now, max_alerts=3, window_hours=24, send=None):
+    """
+    Compare states with the stored ones and store the new states, returns the transitions to alert.
+
+    A sensor check seen for the first time is stored without an alert. A check that already sent max_alerts
+    alerts within window_hours (a flapping sensor) still has its state updated but is not alerted again.
+    send is called with the transitions to alert before anything is stored, when it raises nothing is stored
+    and the same transitions are found again on the next evaluation.
+    """
+    stored = pd.read_sql_query('SELECT sensor_location, sensor_cover, sensor_type, check_name, state AS old_state FROM sensor_alert_state', conn)
+    merged = states.merge(stored, on=SENSOR_KEYS + ['check_name'], how='left')
+    changed = merged[merged['old_state'].notna() & (merged['old_state'] != merged['state'])]
+
+    since = (now - timedelta(hours=window_hours)).strftime('%Y-%m-%d %H:%M:%S')
+    sent = pd.read_sql_query(
+        '''
+        SELECT sensor_location, sensor_cover, sensor_type, check_name, COUNT(*) AS sent
+        FROM sensor_alert_log WHERE sent_at >= ?
+        GROUP BY sensor_location, sensor_cover, sensor_type, check_name
+        ''',
+        conn,
+        params=(since,)
+    )
+    changed = changed.merge(sent, on=SENSOR_KEYS + ['check_name'], how='left').fillna({'sent': 0})
+    alerted = changed[changed['sent'] < max_alerts]
+    if len(alerted) < len(changed):
+        print(f"Rate limited {len(changed) - len(alerted)} alerts")
+
+    alerted = alerted[SENSOR_KEYS + ['check_name', 'old_state', 'state']].reset_index(drop=True)
+    if send is not None and not alerted.empty:
+        send(alerted)
+
+    timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+    new = merged[merged['old_state'].isna() | (merged['old_state'] != merged['state'])]
+    with conn:
+        conn.executemany(
+            '''
+            INSERT INTO sensor_alert_state (sensor_location, sensor_cover, sensor_type, check_name, state, changed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sensor_location, sensor_cover, sensor_type, check_name) DO UPDATE SET state = excluded.state, changed_at = excluded.changed_at
+            ''',
+            [(*row, timestamp) for row in new[SENSOR_KEYS + ['check_name', 'state']].itertuples(index=False)]
+        )
+        conn.executemany(
+            'INSERT INTO sensor_alert_log VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(*row, timestamp) for row in alerted.itertuples(index=False)]
+        )
+    return alerted
+
+
+def alert_text(alerted):
+    lines = []
+    for row in alerted.itertuples(index=False):
+        check = 'Battery' if row.check_name == 'battery' else 'Updated Within 24 Hours'
+        lines.append(f"{row.sensor_location} {row.sensor_cover} {row.sensor_type}: {check} {row.old_state} -> {row.state}")
+    return "\n".join(lines)
+
+
+def evaluate_alerts(store, CONFIG, path=DB_PATH, now=None):
+    """Alert the state transitions since the last evaluation in one mail, returns the transitions"""
+    now = now or datetime.today()
+    metadata_logger = pd.read_csv("data/metadata-logger.csv")
+    states = sensor_states(
+        store,
+        metadata_logger,
+        CONFIG.get('CRITICAL_BATTERY_LIMIT'),
+        CONFIG.get('LOW_BATTERY_LIMIT'),
+        odd_filenames=CONFIG.get('ODD_FILENAMES', {}),
+        now=now
+    )
+
+    def send(alerted):
+        subject = f"IDDE Sensor Alert: {len(alerted)} status changes"
+        send_mail(CONFIG.get('MAIL_FROM'), CONFIG.get('ALERT_MAIL_TO', CONFIG.get('MAIL_TO')), subject, alert_text(alerted), server=CONFIG.get('MAIL_SERVER'))
+        print(f"Sent {subject}")
+
+    # Stored only once the mail is sent, a failed send is alerted again on the next poll
+    with closing(connect(path)) as conn:
+        return transitions(conn, states, now, CONFIG.get('ALERT_MAX_PER_SENSOR', 3), CONFIG.get('ALERT_WINDOW_HOURS', 24), send=send)
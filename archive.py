@@ -0,0 +1,177 @@
+import io
+import json
+import os
+import time
+from urllib.parse import unquote, urlparse
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from sensor_store import COLUMN_RENAMES, compact_dtypes, parse_datetimes, record_savings, sensor_columns, sensor_key, load_sensor as load_sensor_from_csv
+
+
+ARCHIVE_DIR = 'data/archive'
+
+# What was archived of every CSV, kept apart from the sync manifest so a full sync can't reset it
+STATE_FILE = 'state.json'
+
+# Files per date partition before they are merged into one
+MAX_PARTS_PER_PARTITION = 8
+
+
+def sensor_dir(key, archive_dir=ARCHIVE_DIR):
+    location, cover, type_ = key
+    return os.path.join(archive_dir, f"sensor_location={location}", f"sensor_cover={cover}", f"sensor_type={type_}")
+
+
+def load_state(archive_dir=ARCHIVE_DIR):
+    """{filename: {'archived_bytes', 'archived_until'}} of the archived CSVs"""
+    path = os.path.join(archive_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(state, archive_dir=ARCHIVE_DIR):
+    # Write then rename so a crash never leaves half a state behind
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, STATE_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def last_archived(key, archive_dir=ARCHIVE_DIR):
+    # Newest archived timestamp of a sensor, read from its newest date partition
+    directory = sensor_dir(key, archive_dir)
+    partitions = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    for partition in reversed(partitions):
+        parts = [os.path.join(directory, partition, x) for x in os.listdir(os.path.join(directory, partition)) if x.endswith('.parquet')]
+        if parts:
+            return max(pd.read_parquet(x, columns=['datetime'])['datetime'].max() for x in parts)
+    return None
+
+
+def ingest(path, entry, replaced=False, archive_dir=ARCHIVE_DIR, odd_filenames=None):
+    """
+    Append the rows of a synced CSV (see sync.local_path) that are not archived yet, returns the number of new rows.
+
+    entry is the file's entry in the archive state (see load_state), it remembers how many bytes were archived
+    ('archived_bytes') and the last archived timestamp ('archived_until'). Only the bytes past 'archived_bytes'
+    are parsed, unless the file was replaced, then the whole file is read again and only rows after
+    'archived_until' are kept. An entry without 'archived_until' takes it from the sensor's newest partition.
+    """
+    key = sensor_key(os.path.basename(path), odd_filenames)
+    if key is None:
+        return 0
+    if not entry.get('archived_until'):
+        until = last_archived(key, archive_dir)
+        if until is not None:
+            entry['archived_until'] = str(until)
+
+    offset = 0 if replaced else entry.get('archived_bytes', 0)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = max(offset, len(header))
+        f.seek(start)
+        tail = f.read()
+
+    # Only whole lines, a row that is still being written is picked up next time
+    end = tail.rfind(b'\n') + 1
+    entry['archived_bytes'] = start + end
+    if not tail[:end].strip():
+        return 0
+
+    new_rows = pd.read_csv(io.BytesIO(header + tail[:end]))
+    new_rows = new_rows.rename(columns={'SiteName': 'datetime'})
+    new_rows['datetime'] = parse_datetimes(new_rows['datetime'], errors='coerce')
+    new_rows = new_rows.dropna(subset=['datetime'])
+    if entry.get('archived_until'):
+        new_rows = new_rows[new_rows['datetime'] > pd.Timestamp(entry['archived_until'])]
+    if new_rows.empty:
+        return 0
+
+    for date, rows in new_rows.groupby(new_rows['datetime'].dt.strftime('%Y-%m-%d')):
+        partition = os.path.join(sensor_dir(key, archive_dir), f"date={date}")
+        os.makedirs(partition, exist_ok=True)
+        rows.to_parquet(os.path.join(partition, f"part-{time.time_ns()}.parquet"), index=False)
+        compact(partition)
+
+    entry['archived_until'] = str(new_rows['datetime'].max())
+    return len(new_rows)
+
+
+def compact(partition, max_parts=MAX_PARTS_PER_PARTITION):
+    # Daily (or more frequent) appends leave many small files in today's partition, merge them once there are too many
+    parts = sorted(x for x in os.listdir(partition) if x.endswith('.parquet'))
+    if len(parts) <= max_parts:
+        return
+    merged = pd.concat([pd.read_parquet(os.path.join(partition, x)) for x in parts])
+    tmp_path = os.path.join(partition, f"part-{time.time_ns()}.parquet.tmp")
+    merged.to_parquet(tmp_path, index=False)
+    for x in parts:
+        os.remove(os.path.join(partition, x))
+    os.replace(tmp_path, tmp_path[:-len('.tmp')])
+
+
+def read_sensor(key, since=None, columns=None, archive_dir=ARCHIVE_DIR):
+    """
+    Archived rows of one sensor sorted by datetime, None if the sensor has no archive.
+
+    Only the date partitions on or after since are opened, and rows before since are filtered out inside the
+    Parquet reader. A sensor with no partition since then (it stopped reporting) gets its newest partition, so
+    the reports still show when it last updated. Of columns, the ones a part has are read (all columns when
+    None). The number of columns in the widest part is kept in sensor_data.attrs['file_columns'].
+    """
+    directory = sensor_dir(key, archive_dir)
+    if not os.path.isdir(directory):
+        return None
+
+    partitions = sorted(os.listdir(directory))
+    filters = None
+    if since is not None:
+        since = pd.Timestamp(since)
+        recent = [x for x in partitions if x.split('=', 1)[-1] >= since.strftime('%Y-%m-%d')]
+        if recent:
+            partitions = recent
+            filters = [('datetime', '>=', since)]
+        else:
+            partitions = partitions[-1:]
+    frames = []
+    file_columns = 0
+    for partition in partitions:
+        for part in sorted(os.listdir(os.path.join(directory, partition))):
+            if part.endswith('.parquet'):
+                path = os.path.join(directory, partition, part)
+                names = pq.read_schema(path).names
+                file_columns = max(file_columns, len(names))
+                frames.append(pd.read_parquet(path, columns=[x for x in names if x in columns] if columns is not None else None, filters=filters))
+
+    if not frames:
+        return None
+    sensor_data = pd.concat(frames, ignore_index=True)
+    sensor_data = sensor_data.sort_values('datetime', kind='stable').reset_index(drop=True)
+    sensor_data.attrs['file_columns'] = file_columns
+    return sensor_data
+
+
+def load_sensor(data_location, since=None, archive_dir=ARCHIVE_DIR, odd_filenames=None, rules=None, engine='c'):
+    """
+    Loader for SensorStore, reads the archive and falls back to the CSV for sensors that are not archived.
+
+    Either way only the columns the reports read for the sensor's type are loaded (see sensor_store.sensor_columns).
+    """
+    filename = unquote(urlparse(data_location).path.rsplit('/', 1)[-1])
+    key = sensor_key(filename, odd_filenames)
+    sensor_data = None
+    if key is not None:
+        columns = ['datetime'] + sensor_columns(key[2], rules)
+        sensor_data = read_sensor(key, since=since, columns=columns, archive_dir=archive_dir)
+    if sensor_data is None:
+        sensor_data = load_sensor_from_csv(data_location, rules=rules, engine=engine, odd_filenames=odd_filenames)
+        if since is not None:
+            sensor_data = sensor_data[sensor_data['datetime'] >= pd.Timestamp(since)].reset_index(drop=True)
+        return sensor_data
+    sensor_data = compact_dtypes(sensor_data.rename(columns=COLUMN_RENAMES))
+    return record_savings(sensor_data, filename, sensor_data.attrs['file_columns'])
@@ -0,0 +1,53 @@
+"""
+Logger timestamp parsing: pd.to_datetime with DATETIME_FORMAT vs sensor_store.parse_datetimes.
+
+    python benchmarks/bench_datetimes.py --rows 1000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sensor_store import DATETIME_FORMAT, parse_datetimes
+
+
+def synthetic_timestamps(n_rows, malformed=0.001, seed=0):
+    # 6 minute readings, with a few rows the logger mangled
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Series(pd.date_range(end='2024-06-12', periods=n_rows, freq='6min').strftime(DATETIME_FORMAT), dtype=object)
+    broken = rng.random(n_rows) < malformed
+    timestamps[broken] = '1/2/24 3:04:05 PM'
+    return timestamps
+
+
+def best_of(repeat, f):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'pandas (s)':>11} {'fast (s)':>10} {'speedup':>8}")
+    for n_rows in args.rows:
+        timestamps = synthetic_timestamps(n_rows)
+        pandas_time, expected = best_of(args.repeat, lambda: pd.to_datetime(timestamps, format=DATETIME_FORMAT, errors='coerce'))
+        fast_time, result = best_of(args.repeat, lambda: parse_datetimes(timestamps, errors='coerce'))
+
+        pd.testing.assert_series_equal(result, expected.astype('datetime64[ns]'))
+        print(f"{n_rows:>10} {pandas_time:>11.4f} {fast_time:>10.4f} {pandas_time / fast_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Peak memory of get_reports against a synthetic fleet served from a local HTTP server.
+
+    python benchmarks/bench_memory.py --sensors 30 90 270 --days 90
+
+For every fleet size the fleet is synced once with get_raw_data, then get_reports runs in a fresh process and its
+peak resident set size is read from the kernel. The sensor store is capped at --store-mb so the spilled frames
+don't hide how the report stages themselves scale. Results are appended to benchmarks/results/memory.jsonl and
+compared with the last result of the same fleet.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+import fleet
+from bench_pipeline import git_commit, previous_results
+
+
+RESULTS_PATH = os.path.join(BENCHMARKS_DIR, 'results', 'memory.jsonl')
+
+
+def child(run_dir, step):
+    # Runs in its own process, so ru_maxrss is the peak of this step alone
+    os.chdir(run_dir)
+    sys.stdout = open(os.devnull, 'w')
+    if step == 'get_raw_data':
+        from get_raw_data import get_raw_data
+        get_raw_data()
+    else:
+        from get_reports import get_reports
+        get_reports()
+    sys.stdout = sys.__stdout__
+    print(json.dumps({'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}))
+
+
+def run_step(run_dir, step):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', run_dir, step], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{step} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_fleet(n_sensors, days, store_mb, workdir):
+    site_dir = os.path.join(workdir, 'site')
+    run_dir = os.path.join(workdir, 'run')
+    settings = fleet.generate(site_dir, n_sensors, days, now=datetime.now().replace(second=0, microsecond=0))
+
+    server = fleet.make_server(site_dir)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    for folder in ('data', 'reports', 'plots'):
+        os.makedirs(os.path.join(run_dir, folder), exist_ok=True)
+    with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+        json.dump({'DATA_URL': f'{base_url}/data/', 'IMAGES_URL': f'{base_url}/images/', 'SENSOR_STORE_MAX_MB': store_mb, 'PLOT_CACHE': False, **settings}, f, indent=2)
+
+    try:
+        run_step(run_dir, 'get_raw_data')
+        peak = run_step(run_dir, 'get_reports')
+    finally:
+        server.shutdown()
+    data_mb = sum(os.path.getsize(os.path.join(site_dir, 'data', x)) for x in os.listdir(os.path.join(site_dir, 'data'))) / 2**20
+    return {'csv_mb': round(data_mb, 1), **peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, nargs='+', default=[30, 90, 270])
+    parser.add_argument('--days', type=int, default=90, help='days of 6 minute history per sensor')
+    parser.add_argument('--store-mb', type=int, default=32, help='SENSOR_STORE_MAX_MB of the runs')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help="don't append the results")
+    parser.add_argument('--child', nargs=2, metavar=('RUN_DIR', 'STEP'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    history = previous_results(args.results)
+    commit = git_commit()
+    print(f"{'sensors':>8} {'days':>5} {'CSV MB':>8} {'peak RSS MB':>12} {'last':>8}")
+    for n_sensors in args.sensors:
+        workdir = tempfile.mkdtemp(prefix='bench_memory_')
+        try:
+            result = bench_fleet(n_sensors, args.days, args.store_mb, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'sensors': n_sensors,
+            'days': args.days,
+            'store_mb': args.store_mb,
+            **result
+        }
+        same = [x for x in history if (x['sensors'], x['days'], x.get('store_mb')) == (n_sensors, args.days, args.store_mb)]
+        last = f"{same[-1]['peak_rss_mb']:.1f}" if same else ''
+        print(f"{n_sensors:>8} {args.days:>5} {result['csv_mb']:>8.1f} {result['peak_rss_mb']:>12.1f} {last:>8}")
+        if not args.no_save:
+            os.makedirs(os.path.dirname(args.results), exist_ok=True)
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Summary metrics: per-sensor loop vs one vectorized pass over the long frame.
+
+    python benchmarks/bench_metrics.py --sensors 10 100 1000 5000 --days 7
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import build_long_frame, logger_metrics
+
+
+CRITICAL_BATTERY_LIMIT = 2500
+LOW_BATTERY_LIMIT = 3500
+EXPECTED_TIMEPOINTS = (24 * 60) // 7
+TYPES = ['DT', 'TURB', 'RAD']
+
+
+def synthetic_sensors(n_sensors, days, seed=0):
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now().floor('min')
+    index = pd.date_range(end=end, periods=days * 240, freq='6min')
+    for i in range(n_sensors):
+        type_ = TYPES[i % len(TYPES)]
+        n = len(index)
+        sensor_data = pd.DataFrame({'datetime': index, 'Batt': rng.integers(2000, 4200, n).astype(float)})
+        if type_ == 'RAD':
+            sensor_data['ANGLE'] = rng.normal(80, 3, n)
+        if type_ == 'TURB':
+            sensor_data['Turbwo'] = rng.random(n) * 11
+            sensor_data['EC'] = rng.integers(0, 50, n)
+        yield (f'SITE{i // len(TYPES)}', 'GRASS', type_), sensor_data
+
+
+def loop_metrics(sensor_frames, now, since):
+    # The per-sensor loop get_reports used before, reduced to the metric computations
+    rows = []
+    for (location, cover, type_), sensor_data in sensor_frames:
+        sensor_data = sensor_data.copy()
+        sensor_data['Batt'] = pd.to_numeric(sensor_data['Batt'], errors='coerce').fillna(-88)
+        latest_batt_level = sensor_data['Batt'].iloc[-1]
+        if (latest_batt_level != -88) and (latest_batt_level < CRITICAL_BATTERY_LIMIT):
+            battery_status = 'CRITICAL'
+        elif (latest_batt_level != -88) and (CRITICAL_BATTERY_LIMIT <= latest_batt_level <= LOW_BATTERY_LIMIT):
+            battery_status = 'LOW'
+        elif (latest_batt_level != -88) and (latest_batt_level > LOW_BATTERY_LIMIT):
+            battery_status = 'OK'
+        else:
+            battery_status = f"Latest value cannot be read - Latest readable value: {sensor_data[sensor_data['Batt'] != -88]['Batt'].iloc[-1]}"
+        last_modified = pd.Timestamp(sensor_data['datetime'].iloc[-1])
+        last_updated_status = 'NO' if (now - last_modified).total_seconds() / 3600 > 24 else 'YES'
+        percent_missing = int(round(max(0, 100 - ((len(sensor_data[sensor_data['datetime'] >= since]) / EXPECTED_TIMEPOINTS) * 100))))
+        value_status = ''
+        if type_ == 'RAD' and 'ANGLE' in sensor_data.columns:
+            bad_values = sensor_data[(sensor_data['ANGLE'] < 75) | (sensor_data['ANGLE'] > 85)]
+            if len(bad_values) > 0:
+                value_status = f"Angle value (degrees) out of range (Normal range: [75,85]) - {len(bad_values)} bad values"
+        elif type_ == 'TURB':
+            bad_values = sensor_data[sensor_data['Turbwo'] > 10]
+            if len(bad_values) > 0:
+                value_status += f"Turbidity without LED values out of range (Normal range: [0,10]) - {len(bad_values)} bad values; "
+            bad_values = sensor_data[sensor_data['EC'] == 0]
+            if len(bad_values) > 0:
+                value_status += f"EC value is 0 - {len(bad_values)} bad values"
+        rows.append(pd.DataFrame({
+            'sensor_location': [location], 'sensor_cover': [cover], 'sensor_type': [type_],
+            'battery_status': [battery_status], 'lowest_battery_value': [latest_batt_level],
+            'last_updated_status': [last_updated_status], 'last_updated_entry': [last_modified],
+            'percent_missing': [percent_missing], 'value_status': [value_status.strip('; ')]
+        }))
+    return pd.concat(rows, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--days', type=int, default=7, help='days of 6 minute history per sensor')
+    args = parser.parse_args()
+
+    now = datetime.today()
+    since = np.datetime64(now - timedelta(hours=24))
+    print(f"{'sensors':>8} {'rows':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}")
+    for n_sensors in args.sensors:
+        frames = list(synthetic_sensors(n_sensors, args.days))
+
+        start = time.perf_counter()
+        expected = loop_metrics(frames, now, since)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sensors, long_frame = build_long_frame(frames)
+        result = logger_metrics(sensors, long_frame, CRITICAL_BATTERY_LIMIT, LOW_BATTERY_LIMIT, EXPECTED_TIMEPOINTS, now, since)
+        vectorized_time = time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+        print(f"{n_sensors:>8} {len(long_frame):>10} {loop_time:>10.3f} {vectorized_time:>15.3f} {loop_time / vectorized_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Pipeline stages (get_raw_data and get_reports) against a synthetic fleet served from a local HTTP server.
+
+    python benchmarks/bench_pipeline.py --sensors 10 100 1000 --days 7
+
+For every fleet size a cold run (empty data folder) and an incremental run (an hour of new readings appended to
+every CSV) are timed per stage from the run trace (see timing.py). Results are appended to
+benchmarks/results/pipeline.jsonl and compared with the last result of the same fleet, so regressions show up.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+import fleet
+from timing import TRACE, stage
+
+
+RESULTS_PATH = os.path.join(BENCHMARKS_DIR, 'results', 'pipeline.jsonl')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def timed_run(name, get_raw_data, get_reports):
+    TRACE.start(name)
+    with stage('get_raw_data'):
+        get_raw_data()
+    with stage('get_reports'):
+        get_reports()
+    return {
+        'total': round(sum(x['duration'] for x in TRACE.stages if '/' not in x['name']), 3),
+        'stages': {x['name']: x['duration'] for x in TRACE.stages},
+        'summary': TRACE.summary()
+    }
+
+
+def bench_fleet(n_sensors, days, workdir, quiet=True):
+    site_dir = os.path.join(workdir, 'site')
+    run_dir = os.path.join(workdir, 'run')
+    now = datetime.now().replace(second=0, microsecond=0)
+    settings = fleet.generate(site_dir, n_sensors, days, now=now)
+
+    server = fleet.make_server(site_dir)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    for folder in ('data', 'reports', 'plots'):
+        os.makedirs(os.path.join(run_dir, folder), exist_ok=True)
+    with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+        json.dump({'DATA_URL': f'{base_url}/data/', 'IMAGES_URL': f'{base_url}/images/', **settings}, f, indent=2)
+
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(run_dir)
+    try:
+        # The pipeline modules read config.json from the working directory when they are imported
+        from get_raw_data import get_raw_data
+        from get_reports import get_reports
+        if quiet:
+            sys.stdout = open(os.devnull, 'w')
+        runs = {'cold': timed_run('cold', get_raw_data, get_reports)}
+        fleet.append(site_dir, now, now + timedelta(hours=1))
+        runs['incremental'] = timed_run('incremental', get_raw_data, get_reports)
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        os.chdir(cwd)
+        server.shutdown()
+    return runs
+
+
+def previous_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(x) for x in f if x.strip()]
+
+
+def report(result, previous):
+    print(f"\n{result['sensors']} sensors, {result['days']} days, {result['run']} run: {result['total']:.2f} s"
+          + (f" (last {previous['total']:.2f} s at {previous['commit']})" if previous else ''))
+    print(f"{'stage':<40} {'seconds':>9} {'last':>9} {'change':>8}")
+    for name, duration in result['stages'].items():
+        last = (previous or {}).get('stages', {}).get(name)
+        change = f"{(duration - last) / last * 100:+.0f}%" if last else ''
+        print(f"{name:<40} {duration:>9.3f} {last if last is not None else '':>9} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--days', type=int, default=7, help='days of 6 minute history per sensor')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help="don't append the results")
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    history = previous_results(args.results)
+    commit = git_commit()
+    for n_sensors in args.sensors:
+        workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+        try:
+            runs = bench_fleet(n_sensors, args.days, workdir, quiet=not args.verbose)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        for run, timings in runs.items():
+            result = {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': commit,
+                'sensors': n_sensors,
+                'days': args.days,
+                'run': run,
+                **timings
+            }
+            same = [x for x in history if (x['sensors'], x['days'], x['run']) == (n_sensors, args.days, run)]
+            report(result, same[-1] if same else None)
+            if not args.no_save:
+                os.makedirs(os.path.dirname(args.results), exist_ok=True)
+                with open(args.results, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
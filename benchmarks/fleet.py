@@ -0,0 +1,189 @@
+"""
+Synthetic sensor fleet served like the real data server.
+
+    python benchmarks/fleet.py /tmp/fleet --sensors 100 --days 30 --serve 8765
+
+Writes a DT, RAD and TURB CSV (in the loggers' format) for every site under <root>/data and a CAM folder with an
+image listing and a status file under <root>/images, each folder with an Apache style index.html. make_server()
+serves them with Range and If-Modified-Since support, so the incremental sync is exercised too.
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+
+TYPES = ['dt', 'rad', 'turb']
+FREQUENCY_MIN = 6
+DATETIME_FORMAT = '%d/%m/%y %I:%M:%S %p'
+
+INDEX = '''<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">
+<html><head><title>Index of {title}</title></head><body><h1>Index of {title}</h1>
+  <table>
+   <tr><th valign="top"><img src="/icons/blank.gif" alt="[ICO]"></th><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th><th><a href="?C=S;O=A">Size</a></th><th><a href="?C=D;O=A">Description</a></th></tr>
+   <tr><th colspan="5"><hr></th></tr>
+<tr><td valign="top"><img src="/icons/back.gif" alt="[PARENTDIR]"></td><td><a href="/">Parent Directory</a></td><td>&nbsp;</td><td align="right">  - </td><td>&nbsp;</td></tr>
+{rows}   <tr><th colspan="5"><hr></th></tr>
+</table></body></html>'''
+
+ROW = '<tr><td valign="top"><img src="/icons/text.gif" alt="[TXT]"></td><td><a href="{href}">{name}</a></td><td align="right">{modified}  </td><td align="right">{size}</td><td>&nbsp;</td></tr>\n'
+
+
+def index_html(title, entries):
+    """Apache style listing, entries are (name, last modified, size)"""
+    rows = ''.join(ROW.format(href=name, name=name, modified=modified.strftime('%Y-%m-%d %H:%M'), size=size) for name, modified, size in entries)
+    return INDEX.format(title=title, rows=rows)
+
+
+def sensor_rows(type_, start, end, rng, missing=0.02):
+    """Readings of one sensor every FREQUENCY_MIN minutes in [start, end), about missing of them dropped"""
+    index = pd.date_range(start=start, end=end, freq=f'{FREQUENCY_MIN}min', inclusive='left')
+    index = index[rng.random(len(index)) > missing]
+    n = len(index)
+    rows = pd.DataFrame({'SiteName': index.strftime(DATETIME_FORMAT), 'CBC': rng.integers(2000, 4200, n)})
+    if type_ in ('dt', 'rad'):
+        rows['DEPTH'] = np.round(rng.random(n) * 10, 3)
+    if type_ == 'rad':
+        rows['ANGLE'] = np.round(rng.normal(80, 3, n), 2)
+    if type_ == 'turb':
+        rows['Turbwo'] = np.round(rng.random(n) * 11, 2)
+        rows['EC'] = rng.integers(0, 50, n)
+    return rows
+
+
+def sites(n_sensors):
+    return [f'site{i}' for i in range(-(-n_sensors // len(TYPES)))]
+
+
+def write_data_index(root, now):
+    # The listing shows times 17 hours ahead, get_raw_data converts them back
+    names = sorted(x for x in os.listdir(os.path.join(root, 'data')) if x.endswith('.csv'))
+    entries = []
+    for name in names:
+        modified = datetime.fromtimestamp(os.path.getmtime(os.path.join(root, 'data', name)))
+        entries.append((name, modified + timedelta(hours=17), f"{os.path.getsize(os.path.join(root, 'data', name)) // 1024}K"))
+    with open(os.path.join(root, 'data', 'index.html'), 'w') as f:
+        f.write(index_html('/data', entries))
+
+
+def generate(root, n_sensors, days, images_per_site=30, seed=0, now=None):
+    """Write the fleet under root, returns its config.json settings (DATA_URL and IMAGES_URL are up to the caller)"""
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now()
+    start = now - timedelta(days=days)
+    os.makedirs(os.path.join(root, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'images'), exist_ok=True)
+
+    patterns = []
+    site_entries = []
+    for i, site in enumerate(sites(n_sensors)):
+        patterns.append(f'{site}_grass')
+        for type_ in TYPES[:n_sensors - i * len(TYPES)]:
+            sensor_rows(type_, start, now, rng).to_csv(os.path.join(root, 'data', f'{site}_grass_{type_}.csv'), index=False)
+
+        cam = f'{site}_GRASS_CAM'
+        os.makedirs(os.path.join(root, 'images', cam, 'images'), exist_ok=True)
+        images = [(f'img{j}.jpg', now, f"{int(rng.integers(20, 120))}K") for j in range(images_per_site)]
+        with open(os.path.join(root, 'images', cam, 'images', 'index.html'), 'w') as f:
+            f.write(index_html(f'/images/{cam}/images', images))
+        with open(os.path.join(root, 'images', cam, 'index.html'), 'w') as f:
+            f.write(index_html(f'/images/{cam}', [('images/', now - timedelta(hours=8), '-'), ('status', now, '1K')]))
+        with open(os.path.join(root, 'images', cam, 'status'), 'w') as f:
+            f.write(f"date,time,temp,3000\n\ndate,time,temp,{rng.integers(2000, 4000)}\n")
+        site_entries.append((f'{cam}/', now, '-'))
+
+    write_data_index(root, now)
+    with open(os.path.join(root, 'images', 'index.html'), 'w') as f:
+        f.write(index_html('/images', site_entries))
+
+    return {
+        'VALID_PATTERNS': patterns,
+        'CRITICAL_BATTERY_LIMIT': 2500,
+        'LOW_BATTERY_LIMIT': 3500,
+        'MISSING_TIMESTAMP_CHECK': 7,
+        'IMAGE_QUALITY_THRESHOLD': 0.75,
+        'EXPECTED_FREQUENCY_MIN': FREQUENCY_MIN,
+        'ODD_FILENAMES': {}
+    }
+
+
+def append(root, since, now, seed=1):
+    """Append the readings of [since, now) to every CSV, like the loggers do between two runs"""
+    rng = np.random.default_rng(seed)
+    for name in sorted(os.listdir(os.path.join(root, 'data'))):
+        if name.endswith('.csv'):
+            type_ = name.rsplit('_', 1)[-1][:-len('.csv')]
+            path = os.path.join(root, 'data', name)
+            sensor_rows(type_, since, now, rng).to_csv(path, mode='a', header=False, index=False)
+            os.utime(path, (now.timestamp(), now.timestamp()))
+    write_data_index(root, now)
+
+
+class FleetHandler(SimpleHTTPRequestHandler):
+    """Static files with the Range and If-Modified-Since handling sync.sync_file relies on"""
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get('Range')
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+
+        modified = os.path.getmtime(path)
+        since = self.headers.get('If-Modified-Since')
+        if since and int(modified) <= parsedate_to_datetime(since).timestamp():
+            self.send_response(304)
+            self.end_headers()
+            return None
+
+        start = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_response(416)
+            self.end_headers()
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Last-Modified', self.date_time_string(modified))
+        self.end_headers()
+        return f
+
+
+def make_server(root, port=0):
+    """Threaded server of root on 127.0.0.1, port 0 picks a free one (server.server_address[1])"""
+    return ThreadingHTTPServer(('127.0.0.1', port), partial(FleetHandler, directory=root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    parser.add_argument('--sensors', type=int, default=30)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve the fleet after writing it')
+    args = parser.parse_args()
+
+    generate(args.root, args.sensors, args.days)
+    print(f"Wrote {args.sensors} sensors with {args.days} days of history to {args.root}")
+    if args.serve is not None:
+        server = make_server(args.root, args.serve)
+        print(f"Serving on http://127.0.0.1:{server.server_address[1]}/data/ and /images/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import shutil
+from urllib.parse import quote
+
+import pandas as pd
+
+
+CHECKPOINT_DIR = 'data/checkpoints'
+
+
+class Checkpoint:
+    """
+    Results of the finished units of a run (a listing, a synced file, an image site, a sensor's report...), so a run
+    that failed can be started again and resume at the first unit that did not finish.
+
+    Each unit is pickled to its own file under directory/<run_date> as soon as it finishes. Checkpoints of other
+    run dates are deleted when a run starts, clear() deletes them all (main.py --force, or once a run is mailed).
+    A disabled Checkpoint never has a unit done and saves nothing.
+    """
+
+    def __init__(self, run_date=None, directory=CHECKPOINT_DIR, enabled=True):
+        self.directory = directory
+        self.enabled = enabled and run_date is not None
+        self.run_dir = os.path.join(directory, str(run_date))
+        self.resumed = 0  # Units done when the run started
+        if not self.enabled:
+            return
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name != str(run_date):
+                    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.resumed = len(os.listdir(self.run_dir))
+
+    def _path(self, unit):
+        return os.path.join(self.run_dir, quote(unit, safe='') + '.pkl')
+
+    def done(self, unit):
+        return self.enabled and os.path.exists(self._path(unit))
+
+    def load(self, unit):
+        return pd.read_pickle(self._path(unit))
+
+    def save(self, unit, result=None):
+        if not self.enabled:
+            return
+        # Write then rename so a crash never leaves half a unit behind
+        path = self._path(unit)
+        pd.to_pickle(result, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        if self.enabled:
+            os.makedirs(self.run_dir, exist_ok=True)
+
+
+# Used when no checkpoint is given (the daemon, the benchmarks), every unit runs
+NO_CHECKPOINT = Checkpoint(enabled=False)
@@ -0,0 +1,194 @@
+import requests
+import time
+from collections import namedtuple
+from html.parser import HTMLParser
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+
+from timing import event
+
+
+# One <tr> of a directory listing.
+#   links: [(absolute href, link text), ...] for every <a> in the row
+#   cells: text of every <td> in the row (whitespace collapsed, empty cells kept)
+ListingRow = namedtuple('ListingRow', ['links', 'cells'])
+
+
+def _collapse(text):
+    return " ".join(text.split())
+
+
+class ListingParser(HTMLParser):
+    """Parse the rows of an Apache style index page (and any <pre> blocks) without a browser"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.rows = []
+        self.pre = []
+        self._row = None
+        self._cell = None
+        self._link = None
+        self._pre = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._close_row()
+            self._row = ListingRow([], [])
+        elif tag in ('td', 'th'):
+            self._close_cell()
+            # Only <td> text is used, <th> cells are header/separator rows
+            self._cell = [] if (tag == 'td' and self._row is not None) else None
+        elif tag == 'a':
+            self._close_link()
+            href = dict(attrs).get('href')
+            if href is not None and self._row is not None:
+                self._link = (urljoin(self.base_url, href), [])
+        elif tag == 'pre':
+            self._pre = []
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._close_link()
+        elif tag in ('td', 'th'):
+            self._close_cell()
+        elif tag in ('tr', 'table'):
+            self._close_row()
+        elif tag == 'pre' and self._pre is not None:
+            self.pre.append("".join(self._pre))
+            self._pre = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        if self._link is not None:
+            self._link[1].append(data)
+        if self._pre is not None:
+            self._pre.append(data)
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+    def _close_link(self):
+        if self._link is not None:
+            href, text = self._link
+            self._row.links.append((href, _collapse("".join(text))))
+            self._link = None
+
+    def _close_cell(self):
+        self._close_link()
+        if self._cell is not None:
+            self._row.cells.append(_collapse("".join(self._cell)))
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+
+def parse_listing(html, base_url):
+    parser = ListingParser(base_url)
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+# Responses worth another try, the server is busy or briefly unavailable
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class HttpBrowser:
+    """Fetch listing pages with a pooled requests session, retrying with exponential backoff"""
+
+    def __init__(self, pool_size=10, timeout=60, retries=3, backoff=1):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    event('http', url, time.perf_counter() - start, bytes=len(response.content), status=response.status_code, attempts=attempt + 1)
+                    response.raise_for_status()
+                    return response
+                print(f"Got {response.status_code} for {url}, retrying")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"{type(e).__name__} for {url}, retrying")
+            time.sleep(self.backoff * (2 ** attempt))
+
+    def rows(self, url):
+        response = self.get(url)
+        # Resolve links against the final url, the server redirects "site" to "site/"
+        return parse_listing(response.text, response.url).rows
+
+    def text(self, url):
+        response = self.get(url)
+        if 'html' in response.headers.get('Content-Type', ''):
+            return "\n".join(parse_listing(response.text, response.url).pre)
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+class SeleniumBrowser:
+    """Fallback that drives headless Chrome, same interface as HttpBrowser"""
+
+    def __init__(self, timeout=60):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        options = Options()
+        options.add_argument('--headless')  # Run Chrome in headless mode
+        options.add_argument('--no-sandbox')  # Bypass OS security model
+        options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource problems
+        options.add_argument('--disable-gpu')  # Disable GPU hardware acceleration
+        options.add_argument('--remote-debugging-port=9222')  # Enable remote debugging
+        service = Service('/usr/bin/chromedriver')
+        self.driver = webdriver.Chrome(service=service, options=options)
+        self.wait = WebDriverWait(self.driver, timeout)
+
+    def rows(self, url):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        start = time.perf_counter()
+        self.driver.get(url)
+        # Wait until the table rows are present in the new page
+        self.wait.until(EC.presence_of_all_elements_located((By.XPATH, '//tr')))
+        rows = []
+        for tr in self.driver.find_elements(By.XPATH, '//tr'):
+            links = [(a.get_attribute('href'), a.text) for a in tr.find_elements(By.TAG_NAME, 'a')]
+            cells = [td.text for td in tr.find_elements(By.TAG_NAME, 'td')]
+            rows.append(ListingRow([x for x in links if x[0] is not None], cells))
+        event('selenium', url, time.perf_counter() - start, rows=len(rows))
+        return rows
+
+    def text(self, url):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        start = time.perf_counter()
+        self.driver.get(url)
+        # Wait until the data is present on the page
+        text = self.wait.until(EC.presence_of_element_located((By.TAG_NAME, 'pre'))).text
+        event('selenium', url, time.perf_counter() - start, bytes=len(text))
+        return text
+
+    def close(self):
+        self.driver.quit()
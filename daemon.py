@@ -0,0 +1,92 @@
+"""
+Long running alternative to running main.py from cron.
+
+    python daemon.py
+
+Every POLL_INTERVAL_MIN minutes the listings are checked and the changed sensor CSVs are synced, archived and parsed
+again, then changes of a sensor's battery or update status are mailed right away (see alerts.py). The HTTP session,
+the parsed sensor data and the plotting imports stay warm between cycles. The reports are built and mailed once a
+day at REPORT_TIME (US/Pacific).
+"""
+import json
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+
+from alerts import evaluate_alerts
+from get_raw_data import get_raw_data, make_http
+from get_reports import get_reports, make_store
+from main import run_step, send_reports
+from timing import TRACE, stage
+
+
+# Sync statuses (see sync.sync_file) of files whose content changed
+CHANGED = ('appended', 'downloaded')
+
+
+def next_report_time(now, report_time):
+    hour, minute = (int(x) for x in report_time.split(':'))
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return scheduled if scheduled > now else scheduled + timedelta(days=1)
+
+
+def refresh(http, store, CONFIG, report_due=False):
+    # Errors of the daily refresh are mailed like main.py does, the ones of a poll are printed and retried next cycle
+    statuses = run_step(get_raw_data, http=http) if report_due else get_raw_data(http=http)
+    changed = [url for url, status in statuses.items() if status in CHANGED]
+    for url in changed:
+        store.invalidate(url)
+    for url, e in store.preload(changed, CONFIG.get('REPORT_WORKERS', 4)).items():
+        print(f"Could not load {url}: {e}")
+    print(f"{len(changed)} of {len(statuses)} sensor files changed")
+
+    # Mail the battery and update status changes since the last poll
+    if CONFIG.get('ALERTS_ENABLED', True):
+        try:
+            with stage('alerts'):
+                evaluate_alerts(store, CONFIG)
+        except Exception as e:
+            traceback.print_exc()
+
+
+def main():
+    CONFIG = json.loads(open('config.json', 'r').read())
+    poll_interval = CONFIG.get('POLL_INTERVAL_MIN', 5) * 60
+    report_time = CONFIG.get('REPORT_TIME', '07:00')
+    pst = pytz.timezone('US/Pacific')
+
+    http = make_http(CONFIG)
+    store = make_store(CONFIG)
+    next_report = next_report_time(datetime.now(pst), report_time)
+    print(f"Next report at {next_report}")
+    try:
+        while True:
+            report_due = datetime.now(pst) >= next_report
+            TRACE.start('daemon')
+            try:
+                with stage('refresh'):
+                    refresh(http, store, CONFIG, report_due)
+                if report_due:
+                    with stage('get_reports'):
+                        run_step(get_reports, store=store)
+                    with stage('send_reports'):
+                        send_reports()
+            except Exception as e:
+                traceback.print_exc()
+            if CONFIG.get('TRACE_ENABLED', True):
+                TRACE.write()
+            if report_due:
+                next_report = next_report_time(datetime.now(pst), report_time)
+                print(f"Next report at {next_report}")
+
+            wait = min(poll_interval, (next_report - datetime.now(pst)).total_seconds())
+            time.sleep(max(0, wait))
+    finally:
+        store.close()
+        http.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import io
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from sensor_store import COLUMN_RENAMES, DATETIME_FORMAT, parse_datetimes
+from sync import resolve
+
+
+# Bytes read from the end of a file at a time, doubled until the block reaches back past the window
+BLOCK_SIZE = 64 * 1024
+
+# Rows per chunk when the CSV can only be streamed from the start (a url)
+CHUNK_ROWS = 100000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _line_datetime(line, column):
+    try:
+        return datetime.strptime(line.decode().split(',')[column].strip(), DATETIME_FORMAT)
+    except (UnicodeDecodeError, IndexError, ValueError):
+        return None
+
+
+def _tail_bytes(path, since, block_size=BLOCK_SIZE):
+    """Header and the complete lines at the end of path that start just before since, read backwards in blocks"""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        column = header.decode().strip().split(',').index('SiteName')
+        data_start = f.tell()
+        end = f.seek(0, os.SEEK_END)
+
+        start = end
+        while start > data_start:
+            start = max(data_start, end - block_size)
+            f.seek(start)
+            if start > data_start:
+                f.readline()  # Partial line, it belongs to the previous block
+            first = _line_datetime(f.readline(), column)
+            if first is not None and first < since:
+                break
+            block_size *= 2
+
+        f.seek(start)
+        if start > data_start:
+            f.readline()
+        return header, f.read()
+
+
+def read_tail(data_location, since, usecols=None):
+    """
+    Rows of a sensor CSV recorded at or after since, sorted by datetime, without parsing the older rows.
+
+    A local copy (see sync.resolve) is read backwards from its end, the logger appends rows in time order so
+    the read stops once a block reaches back past since. A url is streamed in chunks and only the rows in the
+    window are kept. usecols are the columns read besides SiteName, those missing from the file are skipped.
+    """
+    since = pd.Timestamp(since)
+    source = resolve(data_location)
+    if usecols is not None:
+        usecols = {'SiteName', *usecols}.__contains__
+
+    if os.path.exists(source):
+        header, tail = _tail_bytes(source, since)
+        frames = [pd.read_csv(io.BytesIO(header + tail), usecols=usecols)] if tail.strip() else []
+        for frame in frames:
+            frame['SiteName'] = parse_datetimes(frame['SiteName'], errors='coerce')
+    else:
+        frames = []
+        for chunk in pd.read_csv(source, usecols=usecols, chunksize=CHUNK_ROWS):
+            chunk['SiteName'] = parse_datetimes(chunk['SiteName'], errors='coerce')
+            frames.append(chunk[chunk['SiteName'] >= since])
+
+    if not frames:
+        return pd.DataFrame(columns=['datetime'])
+    sensor_data = pd.concat(frames, ignore_index=True).rename(columns=COLUMN_RENAMES)
+    sensor_data = sensor_data[sensor_data['datetime'] >= since]
+    return sensor_data.sort_values('datetime').reset_index(drop=True)
+
+
+def find_gaps(datetimes, min_gap):
+    """(start, end) of every gap of at least min_gap between consecutive sorted datetimes, as strings"""
+    datetimes = np.asarray(datetimes, dtype='datetime64[ns]')
+    ends = np.flatnonzero(np.diff(datetimes) >= pd.Timedelta(min_gap).to_timedelta64()) + 1
+    starts = pd.DatetimeIndex(datetimes[ends - 1]).strftime(TIMESTAMP_FORMAT)
+    ends = pd.DatetimeIndex(datetimes[ends]).strftime(TIMESTAMP_FORMAT)
+    return list(zip(starts, ends))
+
+
+def percent_missing(datetimes, window, frequency):
+    """Share of the expected readings (one per frequency) missing from a window of datetimes"""
+    expected = pd.Timedelta(window) // pd.Timedelta(frequency)
+    return max(0, round(100 - len(datetimes) / expected * 100))
+
+
+def completeness(datetimes, windows, now, min_gap, frequency):
+    """
+    Gaps and percent of missing readings over each lookback window (e.g. '24h', '7d', '30d') of sorted datetimes
+    that reach back at least to the start of the longest window. Returns {window: (gaps, percent_missing)}.
+    """
+    now = pd.Timestamp(now)
+    datetimes = np.asarray(datetimes, dtype='datetime64[ns]')
+    stats = {}
+    for window in windows:
+        in_window = datetimes[datetimes >= (now - pd.Timedelta(window)).to_datetime64()]
+        stats[window] = (find_gaps(in_window, min_gap), percent_missing(in_window, window, frequency))
+    return stats
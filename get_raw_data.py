@@ -1,21 +1,40 @@
 import pandas as pd
 import json, os
+import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
+from crawler import HttpBrowser, SeleniumBrowser
+from sync import load_manifest, save_manifest, sync_file, local_path, listing_modified, site_unchanged
+import archive
+from checkpoint import NO_CHECKPOINT
+from image_store import known_sites, update_images
+from timing import stage, event
 from utils import *
 
 
-# NOTE: this might take 1 hour to run
+# NOTE: the Selenium fallback (USE_SELENIUM) might take 1 hour to run
 
-def get_raw_data():
+def make_http(CONFIG):
+    max_workers = CONFIG.get('SCRAPER_MAX_WORKERS', 8)
+    return HttpBrowser(
+        pool_size=max(CONFIG.get('HTTP_POOL_SIZE', 10), max_workers),
+        timeout=CONFIG.get('HTTP_TIMEOUT', 60),
+        retries=CONFIG.get('HTTP_RETRIES', 3),
+        backoff=CONFIG.get('HTTP_BACKOFF', 1)
+    )
+
+
+def get_raw_data(use_selenium=None, http=None, checkpoint=None):
+    """
+    Scrape the listings, sync the sensor CSVs and the image metadata. Returns {url: sync status} of the CSVs.
+
+    http is an HttpBrowser to reuse (the daemon keeps one open between runs), a new one is opened and closed otherwise.
+    checkpoint (see checkpoint.py) keeps the listings, synced and archived files and image sites as they finish, a
+    run that failed is resumed from them.
+    """
    
     start_time = time.time()
     # Configuration
@@ -28,39 +47,78 @@ def get_raw_data():
     mail_from = CONFIG.get('MAIL_FROM')
     mail_to = CONFIG.get('MAIL_TO')
     mail_server = CONFIG.get('MAIL_SERVER')
+    if use_selenium is None:
+        use_selenium = CONFIG.get('USE_SELENIUM', False)
+    checkpoint = checkpoint or NO_CHECKPOINT
+    if checkpoint.done('get_raw_data'):
+        print("Raw data already collected in this run")
+        return checkpoint.load('get_raw_data')
+
+    # Initilize browser, plain HTTP unless the Selenium fallback is requested
+    max_workers = CONFIG.get('SCRAPER_MAX_WORKERS', 8)
+    own_http = http is None
+    if own_http:
+        http = make_http(CONFIG)
+    if use_selenium:
+        browser = SeleniumBrowser()
+        listing_workers = 1 # One Chrome driver, it can only load one page at a time
+    else:
+        browser = http
+        listing_workers = max_workers
+
+    # What was fetched last time, unchanged files and sites are not downloaded again
+    manifest = load_manifest() if CONFIG.get('INCREMENTAL_SYNC', True) else {'files': {}, 'sites': {}}
+
+    try:
+        with stage('logger_listing'):
+            if checkpoint.done('logger_listing'):
+                metadata_logger = checkpoint.load('logger_listing')
+            else:
+                metadata_logger = scrape_logger_metadata(browser, data_url, valid_patterns)
+                checkpoint.save('logger_listing', metadata_logger)
+        with stage('sync') as counts:
+            statuses = sync_logger_files(http, metadata_logger, manifest, max_workers, checkpoint)
+            counts['files'] = len(statuses)
+            counts['changed'] = sum(x in ('appended', 'downloaded') for x in statuses.values())
+        if CONFIG.get('ARCHIVE_ENABLED', True):
+            with stage('archive'):
+                archive_logger_files(manifest, statuses, CONFIG.get('ODD_FILENAMES', {}), checkpoint)
+        save_manifest(manifest)
+        with stage('images') as counts:
+            counts['new_images'] = scrape_images_metadata(browser, image_url, valid_patterns, listing_workers, manifest, checkpoint)
+        save_manifest(manifest)
+    finally:
+        if browser is not http:
+            browser.close()
+        if own_http:
+            http.close()
+
+    end_time = time.time()
+    runtime = end_time - start_time
 
-    # Initilize driver
-    options = Options()
-    options.add_argument('--headless')  # Run Chrome in headless mode
-    options.add_argument('--no-sandbox')  # Bypass OS security model
-    options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource problems
-    options.add_argument('--disable-gpu')  # Disable GPU hardware acceleration
-    options.add_argument('--remote-debugging-port=9222')  # Enable remote debugging
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(service=service, options=options)
+    print(f"Runtime: {runtime} seconds")
+    print("Done")
+    statuses = {manifest['files'][filename]['url']: status for filename, status in statuses.items()}
+    checkpoint.save('get_raw_data', statuses)
+    return statuses
 
 
+def scrape_logger_metadata(browser, data_url, valid_patterns):
     ############################################################ SCRAPE CSV FILES FROM WEBPAGE ####################################################
     print("Scraping metadata for the CSV files")
-    # Open the webpage
-    driver.get(data_url)
-
     # Find all the table rows
-    rows = driver.find_elements(By.XPATH, '//tr')
+    rows = browser.rows(data_url)
 
     # Initialize an empty list to store the data
     data_list = []
 
     # Iterate over each row and extract the required details
     for index, row in enumerate(rows):
-        a_tags = row.find_elements(By.TAG_NAME, 'a')
-        for a_tag in a_tags:
-            href = a_tag.get_attribute('href')
+        for href, _ in row.links:
             if ".csv" not in href:
                 continue
             else:
-                td_elements = row.find_elements(By.TAG_NAME, 'td')
-                td_texts = [td.text for td in td_elements if td.text.strip() != '']
+                td_texts = [text for text in row.cells if text.strip() != '']
                 if len(td_texts) >= 3:
                     pattern = "_".join(td_texts[0].replace(".csv", "").lower().split('_')[:2])
                     if pattern in valid_patterns:
@@ -86,91 +144,135 @@ def get_raw_data():
     df['size'] = "" # No need to look at the size
     df.to_csv('data/metadata-logger.csv', index=False)
     print("Done!")
+    return df
     ###############################################################################################################################################
 
 
+def sync_logger_files(http, metadata_logger, manifest, max_workers=1, checkpoint=NO_CHECKPOINT):
+    # Keep a local copy of every sensor CSV, only the changed ones are requested and only their new bytes come over
+    print("Syncing the CSV files")
+    files = {}
+    statuses = {}
+
+    # Each file is checkpointed as soon as it is synced, the files synced before a failure are not requested again.
+    # So is a file that could not be synced, a resumed run goes on past it and reports its error.
+    def sync(row):
+        previous = manifest['files'].get(row['filename'])
+        try:
+            result = sync_file(http, row['data_location'], str(row['last_modified']), previous)
+        except (requests.RequestException, OSError) as e:
+            # The file keeps its last synced copy, the other files are synced as usual
+            result = previous or {'url': row['data_location']}, f"error: {e}"
+        checkpoint.save(f"sync/{row['filename']}", result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            row['filename']: None if checkpoint.done(f"sync/{row['filename']}") else executor.submit(sync, row)
+            for _, row in metadata_logger.iterrows()
+        }
+        for filename, future in futures.items():
+            if future is None:
+                files[filename], statuses[filename] = checkpoint.load(f"sync/{filename}")
+            else:
+                files[filename], statuses[filename] = future.result()
+            print(f"{filename}: {statuses[filename]}")
+    manifest['files'] = files
+    return statuses
 
 
+def archive_logger_files(manifest, statuses, odd_filenames=None, checkpoint=NO_CHECKPOINT):
+    # Append the new rows of every synced CSV to the Parquet archive, date partitioned per sensor
+    print("Archiving new sensor data")
+    state = archive.load_state()
+    for filename, entry in manifest['files'].items():
+        file_state = state.setdefault(filename, {})
+        # A file archived before a failure is not read again, one that could not be synced has nothing new
+        if checkpoint.done(f"archive/{filename}") or statuses.get(filename, '').startswith('error'):
+            continue
+        replaced = statuses.get(filename) == 'downloaded'
+        start = time.perf_counter()
+        new_rows = archive.ingest(local_path(entry['url']), file_state, replaced=replaced, odd_filenames=odd_filenames)
+        event('archive', filename, time.perf_counter() - start, rows=new_rows)
+        print(f"{filename}: {new_rows} new rows")
+        # Saved after every file, the rows of a file are never archived twice
+        archive.save_state(state)
+        checkpoint.save(f"archive/{filename}")
+
+
+def scrape_images_metadata(browser, image_url, valid_patterns, max_workers=1, manifest=None, checkpoint=NO_CHECKPOINT):
     ########################################################### SCRAPE DATA FROM IMAGES ###########################################################
     print("Scraping metadata for the images")
-    driver.get(image_url)
+    if checkpoint.done('image_listing'):
+        img_urls = checkpoint.load('image_listing')
+    else:
+        # Find all the table rows
+        rows = browser.rows(image_url)
 
-    # Find all the table rows
-    rows = driver.find_elements(By.XPATH, '//tr')
+        # get all image URLs of interest
+        img_urls = [
+            os.path.join(href, "images").rsplit('/', 1)[0]
+            for row in rows
+            for href, _ in row.links
+            if "_".join(href.split("/")[-2].split("_")[:2]).lower() in valid_patterns
+        ]
+        checkpoint.save('image_listing', img_urls)
 
-    wait = WebDriverWait(driver, 60)
+    if manifest is None:
+        manifest = {'sites': {}}
+    # The images are kept in sensor_metrics.db (see image_store), sites whose images folder has not changed are not listed again
+    stored_sites = known_sites()
+    # Sites finished before a failure of this run are not fetched again
+    done = {url for url in img_urls if checkpoint.done(f"images/{url}")}
 
-    # get all image URLs of interest
-    img_urls = [
-        os.path.join(a_tag.get_attribute('href'), "images").rsplit('/', 1)[0]
-        for row in rows
-        for a_tag in row.find_elements(By.TAG_NAME, 'a')
-        if "_".join(a_tag.get_attribute("href").split("/")[-2].split("_")[:2]).lower() in valid_patterns
-    ]
+    # Fetch the parent page of every site in parallel, then the images listing and the status file of those that changed
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parent_futures = {url: executor.submit(browser.rows, url) for url in img_urls if url not in done}
 
-    # Iterate over each row and extract the required details
-    df_final = pd.DataFrame()
-    for url in img_urls:
-        print(f"Clicking {url}")
-        driver.get(url)
-        
-        # Wait until the table rows are present in the new page
-        wait.until(EC.presence_of_all_elements_located((By.XPATH, '//tr')))
-        last_modified = pd.Timestamp(driver.find_elements(By.XPATH, "//table/tbody/tr[4]")[0].find_elements(By.TAG_NAME, "td")[2].text)
-        last_modified = last_modified + pd.Timedelta(hours=8)
-
-        driver.get(os.path.join(url, "images"))
-        # Get all rows, then extract <a> and all <td>s with needed info
-        img_filename_list = []
-        size_list = []
-        rows = [x for x in driver.find_elements(By.XPATH, '//tr')][3:-1]
-        for row in rows:
-            img_filename = row.find_elements(By.TAG_NAME, 'a')[0].text
-            print(img_filename)
-            td_elements = row.find_elements(By.TAG_NAME, 'td')
-            td_texts = [td.text for td in td_elements if td.text.strip() != '']
-            size = td_texts[2]
-            img_filename_list.append(img_filename)
-            size_list.append(size)
-        df = pd.DataFrame({
-            'img_filename': img_filename_list,
-            'size': size_list
-        })
-        df['data_location'] = url
-        df['last_modified'] = last_modified
-        df_final = pd.concat([df_final, df])
-
-    # Initialize a dictionary to store the parsed data
-    all_data = {}
-
-    for url in img_urls:
-        print(f"Clicking {url}")
-        driver.get(os.path.join(url, "status"))
-        
-        # Wait until the data is present on the page
-        pre_element = wait.until(EC.presence_of_element_located((By.TAG_NAME, 'pre')))
-        
-        # Extract the text content
-        data = pre_element.text
-        
-        # Split the data into lines
-        lines = data.split('\n')
-        
-        # Initialize a list to store data for the current URL
-        url_data = []
-        
-        # Process each line
-        for line in lines:
-            # Skip empty lines
-            if not line.strip():
+        futures = {}
+        sites = {}
+        for url in img_urls:
+            if url in done:
                 continue
-            # Split the line by commas
-            split_line = line.split(',')
-            # Add the split line to the list for the current URL
-            url_data.append(split_line)
-        
-        # Add the list to the dictionary with the URL as the key
-        all_data[url] = url_data[-1]
+            parent_rows = parent_futures[url].result()
+            modified = listing_modified(parent_rows)
+            entry = manifest['sites'].get(url, {})
+            if site_unchanged(entry, modified, 'images/') and url in stored_sites:
+                images_future = None
+            else:
+                images_future = executor.submit(browser.rows, os.path.join(url, "images"))
+            if site_unchanged(entry, modified, 'status') and entry.get('status'):
+                status_future = None
+            else:
+                status_future = executor.submit(browser.text, os.path.join(url, "status"))
+            futures[url] = (parent_rows, images_future, status_future)
+            sites[url] = {'modified': modified, 'status': entry.get('status')}
+
+        # Collect in listing order so the output does not depend on which request finished first
+        site_rows = []
+        new_images = 0
+        # Initialize a dictionary to store the parsed data
+        all_data = {}
+        for url in img_urls:
+            print(f"Clicking {url}")
+            if url in done:
+                site_row, sites[url] = checkpoint.load(f"images/{url}")
+            else:
+                parent_rows, images_future, status_future = futures[url]
+                # Only the images not stored yet are added, and the ones no longer listed removed
+                if images_future is not None:
+                    new_images += update_images(url, parse_image_listing(images_future.result()))
+                else:
+                    print("Images unchanged")
+                site_row = {'data_location': url, 'last_modified': site_last_modified(parent_rows)}
+                # Add the last status line to the dictionary with the URL as the key
+                if status_future is not None:
+                    sites[url]['status'] = parse_site_status(status_future.result())
+                checkpoint.save(f"images/{url}", (site_row, sites[url]))
+            site_rows.append(site_row)
+            all_data[url] = sites[url]['status']
+
+    manifest['sites'] = sites
 
     data_list = []
 
@@ -184,16 +286,65 @@ def get_raw_data():
 
     tmp = pd.DataFrame(data_list)
 
-    df_final = df_final.merge(
+    print(f"{new_images} new images")
+
+    df_final = pd.DataFrame(site_rows, columns=['data_location', 'last_modified']).merge(
         tmp,
         how='left',
         on=['data_location']
     )
 
     df_final.to_csv("data/metadata-images.csv", index=False)
-    end_time = time.time()
-    runtime = end_time - start_time
-
-    print(f"Runtime: {runtime} seconds")
-    print("Done")
+    return new_images
     ###############################################################################################################################################
+
+
+def listing_time(last_modified):
+    # Last modified value(s) of a listing, 8 hours behind UTC
+    return pd.to_datetime(last_modified, errors='coerce') + pd.Timedelta(hours=8)
+
+
+def site_last_modified(parent_rows):
+    # Last modified column of the first entry in the site folder
+    return listing_time(parent_rows[3].cells[2])
+
+
+def parse_image_listing(image_rows):
+    # Get all rows, then extract <a> and all <td>s with needed info
+    img_filename_list = []
+    modified_list = []
+    size_list = []
+    rows = image_rows[3:-1]
+    for row in rows:
+        img_filename = row.links[0][1]
+        print(img_filename)
+        td_texts = [text for text in row.cells if text.strip() != '']
+        size = td_texts[2]
+        img_filename_list.append(img_filename)
+        modified_list.append(td_texts[1])
+        size_list.append(size)
+    return pd.DataFrame({
+        'img_filename': img_filename_list,
+        'size': size_list,
+        'modified': listing_time(pd.Series(modified_list, dtype=str))
+    })
+
+
+def parse_site_status(data):
+    # Split the data into lines
+    lines = data.split('\n')
+
+    # Initialize a list to store data for the current URL
+    url_data = []
+
+    # Process each line
+    for line in lines:
+        # Skip empty lines
+        if not line.strip():
+            continue
+        # Split the line by commas
+        split_line = line.split(',')
+        # Add the split line to the list for the current URL
+        url_data.append(split_line)
+
+    return url_data[-1]
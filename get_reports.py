@@ -1,13 +1,25 @@
 import pandas as pd
 import json, pytz
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from fpdf import FPDF
 from utils import determine_status
 from datetime import timedelta
 from datetime import datetime, timezone
-import sqlite3
+from functools import partial
+from sensor_store import SensorStore, load_sensor, sensor_columns
+from metrics import build_long_frame, logger_metrics, image_metrics
+from metrics_db import save_metrics
+from image_store import quality_stats
+from gaps import completeness, find_gaps, read_tail
+from rules import load_rules, check_values, status_text
+from history import battery_forecast, forecast_text
+from plotting import PlotJob, DEFAULT_MAX_POINTS, DEFAULT_PLOT_PPI, depth_series, plot_dpi, render_plots, evict_plot_cache
+import archive
+from checkpoint import NO_CHECKPOINT
+from timing import lap, event
 from utils import *
 
 
@@ -16,7 +28,40 @@ with open('config.json', 'r') as f:
     CONFIG = json.load(f)
 ODD_FILENAMES = CONFIG.get('ODD_FILENAMES', {})
 
-def get_reports():
+def load_recent_sensor(data_location, history_days=None, rules=None, engine='c'):
+    # Read from the Parquet archive when there is one, only the partitions within REPORT_HISTORY_DAYS (all by default)
+    since = pd.Timestamp(datetime.today() - timedelta(days=history_days)).floor('D') if history_days else None
+    return archive.load_sensor(data_location, since=since, odd_filenames=ODD_FILENAMES, rules=rules, engine=engine)
+
+
+def make_store(CONFIG):
+    # Sensors are loaded with only the columns the reports and the VALUE_RULES of their type read
+    rules = load_rules(CONFIG.get('VALUE_RULES'))
+    engine = CONFIG.get('SENSOR_CSV_ENGINE', 'c')
+    if CONFIG.get('ARCHIVE_ENABLED', True):
+        loader = partial(load_recent_sensor, history_days=CONFIG.get('REPORT_HISTORY_DAYS'), rules=rules, engine=engine)
+    else:
+        loader = partial(load_sensor, rules=rules, engine=engine, odd_filenames=ODD_FILENAMES)
+    return SensorStore(
+        max_memory_mb=CONFIG.get('SENSOR_STORE_MAX_MB', 512),
+        spill_format=CONFIG.get('SENSOR_STORE_SPILL_FORMAT', 'feather'),
+        loader=loader
+    )
+
+
+def error_text(e):
+    # Shown in the reports in place of a sensor that failed, the core PDF fonts are latin-1 only
+    return f"{type(e).__name__}: {e}".encode('latin-1', 'replace').decode('latin-1')
+
+
+def get_reports(store=None, checkpoint=None):
+    # checkpoint (see checkpoint.py) keeps the detailed report of every sensor as it finishes, a run that failed
+    # computes only the sensors it had not reached
+    checkpoint = checkpoint or NO_CHECKPOINT
+    if checkpoint.done('get_reports'):
+        print("Reports already generated in this run")
+        return
+
     ############################################################ GENERATE SUMMARY REPORT ########################################################
     print("GENERATING SUMMARY REPORT")
     # Configuration
@@ -25,6 +70,8 @@ def get_reports():
     LOW_BATTERY_LIMIT = CONFIG.get('LOW_BATTERY_LIMIT')
     IMAGE_QUALITY_THRESHOLD = CONFIG.get('IMAGE_QUALITY_THRESHOLD')
     EXPECTED_FREQUENCY = CONFIG.get('EXPECTED_FREQUENCY_MIN')
+    VALUE_RULES = load_rules(CONFIG.get('VALUE_RULES'))
+    REPORT_WORKERS = CONFIG.get('REPORT_WORKERS', 4)
 
     # Get today dates
     today = datetime.now(timezone.utc)
@@ -33,6 +80,11 @@ def get_reports():
     todaymonth = today.month
     todaydate = today.day
 
+    # Every sensor is loaded and parsed once, then shared by both reports (and kept between runs by the daemon)
+    own_store = store is None
+    if own_store:
+        store = make_store(CONFIG)
+
     # Load the data
     metadata_logger = pd.read_csv("data/metadata-logger.csv")
     metadata_images = pd.read_csv("data/metadata-images.csv")
@@ -42,91 +94,46 @@ def get_reports():
     metadata_logger[['sensor_location', 'sensor_cover', 'sensor_type']] = metadata_logger['filename'].str.extract(r'(\w+)_(\w+)_(\w+)\.csv')
     metadata_logger[['sensor_location', 'sensor_cover', 'sensor_type']] = metadata_logger[['sensor_location', 'sensor_cover', 'sensor_type']].map(str.upper)
 
-    tmp = []
-
-
-    for (location, cover, type_), subdf in metadata_logger.groupby(['sensor_location', 'sensor_cover', 'sensor_type']):
-        print((location, cover, type_))
-        try:
-            sensor_data = pd.read_csv(subdf['data_location'].iloc[0])
-        except Exception as e:
-            continue
+    # Fetch and parse the sensors in REPORT_WORKERS threads, both reports then read them from the store
+    lap('summary/load')
+    store.preload(metadata_logger['data_location'], REPORT_WORKERS)
 
-        sensor_data = sensor_data.rename(columns={'SiteName': 'datetime', 'CBC': 'Batt'})
-        sensor_data['datetime'] = pd.to_datetime(sensor_data['datetime'], format='%d/%m/%y %I:%M:%S %p')
-        sensor_data = sensor_data.sort_values('datetime')
-
-        # Battery Check
-        sensor_data['Batt'] = pd.to_numeric(sensor_data['Batt'], errors='coerce').fillna(-88)
-        latest_batt_level = sensor_data['Batt'].iloc[-1]
-
-        if (latest_batt_level != -88) and (latest_batt_level < CRITICAL_BATTERY_LIMIT):
-            battery_status = 'CRITICAL'
-        elif (latest_batt_level != -88) and (CRITICAL_BATTERY_LIMIT <= latest_batt_level <= LOW_BATTERY_LIMIT):
-            battery_status = 'LOW'
-        elif (latest_batt_level != -88) and (latest_batt_level > LOW_BATTERY_LIMIT):
-            battery_status = 'OK'
-        else:
-            battery_status = f"Latest value cannot be read - Latest readable value: {sensor_data[sensor_data['Batt'] != -88]['Batt'].iloc[-1]}"
-
-        # Last Updated Check
-        last_modified = pd.Timestamp(sensor_data['datetime'].iloc[-1])
-        last_updated_status = 'NO' if (datetime.today() - last_modified).total_seconds()/3600 > 24 else 'YES'
-        last_updated_entry = last_modified
-
-        lowest_battery_value = sensor_data['Batt'].iloc[-1]
-        expected_timepoints = (24 * 60) // int(CONFIG.get('MISSING_TIMESTAMP_CHECK'))
-        if last_updated_status == 'YES':
-            percent_missing = int(
-                round(
-                    max(
-                        0, 
-                        100 - ((len(sensor_data[sensor_data['datetime'] >= (_24_hours_ago.to_datetime64())]) / expected_timepoints) * 100)
-                    )
-                )
-            )
-        else:
-            percent_missing = "Cannot be determined - Data was not available for the last within 24 hours."
-
-        # Value Range Checks for RAD and TURB
-        value_status = ''
-        num_bad_values = 0
-
-        if type_ == 'RAD':
-            # Check for 'ANGLE' column values outside [75, 85]
-            if 'ANGLE' in sensor_data.columns:
-                bad_values = sensor_data[(sensor_data['ANGLE'] < 75) | (sensor_data['ANGLE'] > 85)]
-                num_bad_values = len(bad_values)
-                if num_bad_values > 0:
-                    value_status = f"Angle value (degrees) out of range (Normal range: [75,85]) - {num_bad_values} bad values"
-
-        elif type_ == 'TURB':
-            # Check for 'Turbwo' column values greater than 10
-            if 'Turbwo' in sensor_data.columns:
-                bad_values = sensor_data[sensor_data['Turbwo'] > 10]
-                num_bad_values += len(bad_values)
-                if num_bad_values > 0:
-                    value_status += f"Turbidity without LED values out of range (Normal range: [0,10]) - {num_bad_values} bad values; "
-
-            # Check for 'EC' column values equal to 0
-            if 'EC' in sensor_data.columns:
-                bad_values = sensor_data[sensor_data['EC'] == 0]
-                num_bad_values += len(bad_values)
-                if len(bad_values) > 0:
-                    value_status += f"EC value is 0 - {len(bad_values)} bad values"
-
-        report = subdf.assign(
-            battery_status=battery_status,
-            lowest_battery_value=lowest_battery_value,
-            last_updated_status=last_updated_status,
-            last_updated_entry=last_updated_entry,
-            percent_missing=percent_missing,
-            value_status=value_status.strip('; ')
-        )
-
-        tmp.append(report[['sensor_location', 'sensor_cover', 'sensor_type', 'last_modified', 'size', 'battery_status', 'lowest_battery_value', 'last_updated_status', 'last_updated_entry', 'percent_missing', 'data_location', 'value_status']])
-
-    data_report = pd.concat(tmp)
+    # Stack every sensor into one long frame and compute all summary metrics in a single vectorized pass
+    load_errors = {}
+    def sensor_frames():
+        for (location, cover, type_), subdf in metadata_logger.groupby(['sensor_location', 'sensor_cover', 'sensor_type']):
+            print((location, cover, type_))
+            try:
+                sensor_data = store.get(subdf['data_location'].iloc[0])
+            except Exception as e:
+                print(f"Could not load {(location, cover, type_)}: {e}")
+                load_errors[(location, cover, type_)] = error_text(e)
+                continue
+            yield (location, cover, type_), sensor_data
+
+    lap('summary/metrics')
+    sensors, long_frame = build_long_frame(sensor_frames(), VALUE_RULES)
+    expected_timepoints = (24 * 60) // int(CONFIG.get('MISSING_TIMESTAMP_CHECK'))
+    sensor_metrics = logger_metrics(
+        sensors,
+        long_frame,
+        CRITICAL_BATTERY_LIMIT,
+        LOW_BATTERY_LIMIT,
+        expected_timepoints,
+        now=datetime.today(),
+        since=_24_hours_ago.to_datetime64(),
+        rules=VALUE_RULES
+    )
+    del long_frame
+
+    data_report = metadata_logger.merge(sensor_metrics, on=['sensor_location', 'sensor_cover', 'sensor_type']).sort_values(['sensor_location', 'sensor_cover', 'sensor_type'], kind='stable')
+    data_report = data_report[['sensor_location', 'sensor_cover', 'sensor_type', 'last_modified', 'size', 'battery_status', 'lowest_battery_value', 'last_updated_status', 'last_updated_entry', 'percent_missing', 'data_location', 'value_status']]
+
+    # A sensor that could not be loaded is listed with its error rather than left out
+    if load_errors:
+        error_rows = pd.DataFrame([(*key, error) for key, error in load_errors.items()], columns=['sensor_location', 'sensor_cover', 'sensor_type', 'error'])
+        error_rows = metadata_logger.merge(error_rows, on=['sensor_location', 'sensor_cover', 'sensor_type'])
+        data_report = pd.concat([data_report, error_rows[['sensor_location', 'sensor_cover', 'sensor_type', 'last_modified', 'size', 'data_location', 'error']]])
 
     # Extracted 'sensor_location', 'sensor_cover', 'sensor_type'
     metadata_images['extracted_part'] = metadata_images['data_location'].str.extract(r'\/(\w+_\w+_\w+)')[0]
@@ -134,43 +141,9 @@ def get_reports():
     metadata_images[['sensor_location', 'sensor_cover', 'sensor_type']] = metadata_images['extracted_part'].str.split('_', expand=True)
     metadata_images['sensor_location'] = metadata_images['sensor_location'].str.upper()
 
-    tmp = []
-    for (location, cover, type_), subdf in metadata_images.groupby(['sensor_location', 'sensor_cover', 'sensor_type']):
-        last_modified = (pd.Timestamp(subdf['last_modified'].iloc[0])).replace(tzinfo=timezone.utc)
-        last_updated_status = 'NO' if (today - last_modified).total_seconds()/3600 > 24 else 'YES'
-        last_updated_entry = last_modified
-        subdf['size'] = pd.to_numeric(subdf['size'].str.replace('K', ''))
-
-        # Define an upper bound for size (100kb)
-        subdf = subdf[subdf['size'] <= 100]
-        max_size = subdf['size'].max()
-        percent_hq_images = int(round((len(subdf[subdf['size'] >= IMAGE_QUALITY_THRESHOLD * max_size]) / len(subdf)) * 100))
-
-        if (subdf['latest_battery_level'].iloc[0] != -88) and (subdf['latest_battery_level'].iloc[0] <= CRITICAL_BATTERY_LIMIT):
-            battery_status = 'CRITICAL'
-        elif CRITICAL_BATTERY_LIMIT < subdf['latest_battery_level'].iloc[0] <= LOW_BATTERY_LIMIT:
-            battery_status = 'LOW'
-        elif subdf['latest_battery_level'].iloc[0] == -88:
-            battery_status = f"{subdf[subdf['latest_battery_level'] != -88]['latest_battery_level'].iloc[0]}"
-        else:
-            battery_status = 'OK'
-
-        report = pd.DataFrame({
-            'sensor_location': [location],
-            'sensor_cover': [cover],
-            'sensor_type': [type_],
-            'last_modified': [last_modified],
-            'last_updated_status': [last_updated_status],
-            'last_updated_entry': [last_updated_entry],
-            'percent_hq_images': [percent_hq_images],
-            'max_image_size': [max_size],
-            'data_location': [subdf['data_location'].iloc[0]],
-            'lowest_battery_value': [subdf['latest_battery_level'].iloc[0]],
-            'battery_status': [battery_status]
-        })
-        tmp.append(report)
-
-    image_report = pd.concat(tmp)
+    # Image quality over all listed images and each IMAGE_WINDOWS, from the size counts kept by get_raw_data
+    image_stats = quality_stats(IMAGE_QUALITY_THRESHOLD, CONFIG.get('IMAGE_WINDOWS', ['24h', '7d']), today)
+    image_report = image_metrics(metadata_images, image_stats, CRITICAL_BATTERY_LIMIT, LOW_BATTERY_LIMIT, today)
 
     # Combine and sort final report
     combined_df = pd.concat([data_report, image_report]).sort_values(['sensor_location', 'sensor_cover', 'sensor_type']).reset_index(drop=True)
@@ -205,6 +178,7 @@ def get_reports():
     final_report = pd.concat(processed_groups).reset_index(drop=True)
 
     # Create PDF
+    lap('summary/pdf')
     pdf = PDF()
     pdf.add_page()
 
@@ -230,6 +204,15 @@ def get_reports():
         chapter_body_text = "\n".join(status_texts)
         pdf.chapter_body(chapter_body_text)
 
+    # Battery drain projected from the daily metrics of the last BATTERY_FORECAST_DAYS
+    forecast_days = CONFIG.get('BATTERY_FORECAST_DAYS', 30)
+    if forecast_days:
+        forecast = battery_forecast(forecast_days, LOW_BATTERY_LIMIT, CRITICAL_BATTERY_LIMIT, today)
+        forecast = forecast_text(forecast, LOW_BATTERY_LIMIT, CRITICAL_BATTERY_LIMIT)
+        if forecast:
+            pdf.chapter_title(f"Battery Forecast (last {forecast_days} days)")
+            pdf.chapter_body(forecast)
+
     # Save PDF
     pdf_output_path = f'reports/Summary_Report_{todayyear}-{todaymonth}-{todaydate}.pdf'
     pdf.output(pdf_output_path)
@@ -242,84 +225,123 @@ def get_reports():
 
     ############################################################ GENERATE DETAILED REPORT ########################################################
     print("GENERATING DETAILED REPORT")
+    lap('detailed/sensors')
     report = []
     pdf = FPDF()
 
     # Format the output path with today's date
     pdf_output_path = f'reports/Detailed_Report_{todayyear}-{todaymonth}-{todaydate}.pdf'
 
-    sensor_data_list = []
     metrics_data_list = []  # New list to store metrics
+    site_series = {}  # (location, cover) -> {'DT': series, 'RAD': series}, the decimated depth series to plot
+    gap_windows = CONFIG.get('GAP_WINDOWS', ['7d', '30d'])
+    plot_max_points = CONFIG.get('PLOT_MAX_POINTS', DEFAULT_MAX_POINTS)
+
+    # The text, metrics and data of every sensor are computed in REPORT_WORKERS threads
+    def sensor_detail(location, cover, type_, subdf):
+        sensor_start = time.perf_counter()
+        sensor_data = store.get(subdf['data_location'].iloc[0])
+
+        last_timestamp_recorded = sensor_data['datetime'].iloc[-1]
+        current_battery_level = sensor_data['Batt'].iloc[-1]
+
+        # Initialize metrics
+        value_status = 'OK'
+        problematic_timestamps = []
+        missing_periods_list = []
+
+        # The last 24 hours and the longest of GAP_WINDOWS in one read from the tail of the synced CSV, the full
+        # history above is only used for the last reading and the plots
+        now = datetime.today()
+        since_24h = _24_hours_ago.tz_localize(None)
+        since = min([since_24h] + [pd.Timestamp(now) - pd.Timedelta(x) for x in gap_windows])
+        tail = read_tail(subdf['data_location'].iloc[0], since, usecols=sensor_columns(type_, VALUE_RULES))
+
+        # Check for missing data periods
+        if subdf['last_updated_status'].iloc[0] == 'YES':
+            tmp = tail[tail['datetime'] >= since_24h].reset_index(drop=True)
+            
+            # Find missing data periods
+            missing_periods_list = find_gaps(tmp['datetime'], pd.Timedelta(minutes=CONFIG.get('MISSING_TIMESTAMP_CHECK')))
+            
+            missing_periods_text = str(missing_periods_list) if missing_periods_list else 'No missing data periods.'
 
-    for (location, cover, type_), subdf in final_report.groupby(['sensor_location', 'sensor_cover', 'sensor_type'], sort=False):
-        print((location, cover, type_))
-        if ('UNAVAILABLE' in type_) or (type_ == 'CAM'):
-            report_text = ""
+            # Value range checks, all rules of the sensor type in one pass
+            counts, timestamps = check_values(tmp, VALUE_RULES, type_)
+            value_status = status_text(VALUE_RULES, counts, detail=True) or 'OK'
+            for rule_timestamps in timestamps:
+                problematic_timestamps.extend(rule_timestamps)
         else:
+            value_status = 'Cannot be determined. Data is not up-to-date.'
+            missing_periods_text = 'Cannot be determined. Data is not up-to-date.'
+
+        # Completeness over the longer GAP_WINDOWS, from the same tail
+        window_texts = []
+        window_stats = completeness(
+            tail['datetime'],
+            gap_windows,
+            now,
+            pd.Timedelta(minutes=CONFIG.get('MISSING_TIMESTAMP_CHECK')),
+            pd.Timedelta(minutes=CONFIG.get('MISSING_TIMESTAMP_CHECK'))
+        )
+        for window, (gaps, missing) in window_stats.items():
+            window_texts.append(f"Missing Data (last {window}): {missing}% in {len(gaps)} gaps\n")
+
+        # Prepare the report text
+        report_text = f"Last Timestamp Recorded: {last_timestamp_recorded}\n" \
+                    f"Current Battery Level: {current_battery_level}\n" \
+                    f"Data are missing in these periods: {missing_periods_text}\n" \
+                    f"{''.join(window_texts)}" \
+                    f"Value Range Check: {value_status}\n" \
+                    f"Problematic Timestamps for Value Range Check: {', '.join(problematic_timestamps) if problematic_timestamps else 'None'}\n"
+
+        # Only the depth series decimated to PLOT_MAX_POINTS (min and max per bucket) is kept for the plots,
+        # the sensor's frame is released when it returns
+        series = depth_series(sensor_data, plot_max_points) if type_ in ('DT', 'RAD') else None
+        event('report_sensor', f"{location} {cover} {type_}", time.perf_counter() - sensor_start, rows=len(sensor_data))
+
+        # Collect metrics data
+        metrics = {
+            'sensor_location': location,
+            'sensor_cover': cover,
+            'sensor_type': type_,
+            'last_timestamp_recorded': last_timestamp_recorded.strftime('%Y-%m-%d %H:%M:%S'),
+            'current_battery_level': current_battery_level,
+            'missing_periods': str(missing_periods_list),
+            'value_status': value_status,
+            'problematic_timestamps': ', '.join(problematic_timestamps) if problematic_timestamps else 'None',
+            'report_date': today.strftime('%Y-%m-%d')
+        }
+        return report_text, metrics, series
+
+    # Results are taken in the report order, so the pages and the metrics rows come out as with one worker
+    with ThreadPoolExecutor(max_workers=max(1, REPORT_WORKERS)) as executor:
+        futures = []
+        for (location, cover, type_), subdf in final_report.groupby(['sensor_location', 'sensor_cover', 'sensor_type'], sort=False):
+            unit = f"sensor/{location} {cover} {type_}"
+            if ('UNAVAILABLE' in type_) or (type_ == 'CAM'):
+                futures.append(((location, cover, type_), None, True))
+            elif checkpoint.done(unit):
+                # Reported before this run failed
+                futures.append(((location, cover, type_), executor.submit(checkpoint.load, unit), True))
+            else:
+                futures.append(((location, cover, type_), executor.submit(sensor_detail, location, cover, type_, subdf), False))
+
+        for (location, cover, type_), future, resumed in futures:
+            print((location, cover, type_))
+            if future is None:
+                continue
             try:
-                sensor_data = pd.read_csv(subdf['data_location'].iloc[0])
+                report_text, metrics, series = future.result()
+                if not resumed:
+                    checkpoint.save(f"sensor/{location} {cover} {type_}", (report_text, metrics, series))
+                site_series.setdefault((location, cover), {})[type_] = series
+                metrics_data_list.append(metrics)
             except Exception as e:
-                continue
-            
-            sensor_data = sensor_data.rename(
-                columns={'SiteName': 'datetime', 'CBC': 'Batt', 'DEPTH': 'depth', 'Depth': 'depth', 'TURBwo': 'turbwo'}
-            )
-            # Convert from UTC to PST
-            sensor_data['datetime'] = pd.to_datetime(sensor_data['datetime'], format='%d/%m/%y %I:%M:%S %p')
-            sensor_data = sensor_data.sort_values('datetime')
-            last_timestamp_recorded = sensor_data['datetime'].iloc[-1]
-            current_battery_level = sensor_data['Batt'].iloc[-1]
-
-            # Initialize metrics
-            value_status = 'OK'
-            problematic_timestamps = []
-            missing_periods_list = []
-
-            # Check for missing data periods
-            if subdf['last_updated_status'].iloc[0] == 'YES':
-                tmp = sensor_data[sensor_data['datetime'] >= (_24_hours_ago.to_datetime64())].reset_index(drop=True)
-                
-                # Find missing data periods
-                tmp['time_diff'] = tmp['datetime'].diff()
-                missing_data_periods = tmp[tmp['time_diff'] >= pd.Timedelta(minutes=CONFIG.get('MISSING_TIMESTAMP_CHECK'))]
-                
-                for idx, row in missing_data_periods.iterrows():
-                    prev_row = tmp.iloc[idx - 1]
-                    missing_periods_list.append((prev_row['datetime'].strftime('%Y-%m-%d %H:%M:%S'), row['datetime'].strftime('%Y-%m-%d %H:%M:%S')))
-                
-                missing_periods_text = str(missing_periods_list) if missing_periods_list else 'No missing data periods.'
-
-                # Check data based on sensor type
-                if type_ == 'RAD':
-                    if 'ANGLE' in tmp.columns:
-                        out_of_range = tmp[(tmp['ANGLE'] < 75) | (tmp['ANGLE'] > 85)]
-                        if not out_of_range.empty:
-                            value_status = f"ANGLE VALUE OUT OF RANGE [75,85] - {len(out_of_range)} bad values"
-                            problematic_timestamps.extend(out_of_range['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist())
-
-                elif type_ == 'TURB':
-                    if 'turbwo' in tmp.columns:
-                        out_of_range_turbwo = tmp[tmp['turbwo'] > 10]
-                        if not out_of_range_turbwo.empty:
-                            value_status += f"TURBWO VALUE OUT OF RANGE [>10] - {len(out_of_range_turbwo)} bad values; "
-                            problematic_timestamps.extend(out_of_range_turbwo['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist())
-
-                    if 'EC' in tmp.columns:
-                        out_of_range_ec = tmp[tmp['EC'] == 0]
-                        if not out_of_range_ec.empty:
-                            value_status += f"EC VALUE IS 0 - {len(out_of_range_ec)} bad values"
-                            problematic_timestamps.extend(out_of_range_ec['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist())
-            else:
-                value_status = 'Cannot be determined. Data is not up-to-date.'
-                missing_periods_text = 'Cannot be determined. Data is not up-to-date.'
-
-            # Prepare the report text
-            report_text = f"Last Timestamp Recorded: {last_timestamp_recorded}\n" \
-                        f"Current Battery Level: {current_battery_level}\n" \
-                        f"Data are missing in these periods: {missing_periods_text}\n" \
-                        f"Value Range Check: {value_status}\n" \
-                        f"Problematic Timestamps for Value Range Check: {', '.join(problematic_timestamps) if problematic_timestamps else 'None'}\n"
-            
+                # The sensor gets a page with its error, the other sensors are reported as usual
+                print(f"Could not report {(location, cover, type_)}: {e}")
+                report_text = f"Error: {error_text(e)}\n"
+
             pdf.add_page()
             # Add section header with bold and larger font size
             pdf.set_font("Arial", 'B', size=16)
@@ -328,119 +350,47 @@ def get_reports():
             # Add report text with normal font size
             pdf.set_font("Arial", size=12)
             pdf.multi_cell(0, 10, report_text)
-            
-            sensor_data = sensor_data.assign(
-                sensor_location=location,
-                sensor_cover=cover,
-                sensor_type=type_
-            )
-            sensor_data_list.append(sensor_data)
-
-            # Collect metrics data
-            metrics_data_list.append({
-                'sensor_location': location,
-                'sensor_cover': cover,
-                'sensor_type': type_,
-                'last_timestamp_recorded': last_timestamp_recorded.strftime('%Y-%m-%d %H:%M:%S'),
-                'current_battery_level': current_battery_level,
-                'missing_periods': str(missing_periods_list),
-                'value_status': value_status,
-                'problematic_timestamps': ', '.join(problematic_timestamps),
-                'report_date': f"{todayyear}-{todaymonth}-{todaydate}"
-            })
 
+    if own_store:
+        store.close()
     metrics_df = pd.DataFrame(metrics_data_list)
-    sensor_data_final = pd.concat(sensor_data_list)
-
-    conn = sqlite3.connect('sensor_metrics.db')
-    cursor = conn.cursor()
-    for _, row in metrics_df.iterrows():
-        # Convert missing periods and problematic timestamps to strings
-        missing_periods = str(row['missing_periods']) if row['missing_periods'] else 'No missing data periods.'
-        problematic_timestamps = ', '.join(row['problematic_timestamps']) if row['problematic_timestamps'] else 'None'
-        cursor.execute('''
-            INSERT INTO detailed_report_metrics (
-                sensor_location, 
-                sensor_cover, 
-                sensor_type, 
-                last_timestamp_recorded, 
-                current_battery_level, 
-                missing_periods, 
-                value_status, 
-                problematic_timestamps,
-                report_date
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            row['sensor_location'],
-            row['sensor_cover'],
-            row['sensor_type'],
-            row['last_timestamp_recorded'],
-            row['current_battery_level'],
-            missing_periods,
-            row['value_status'],
-            problematic_timestamps,
-            row['report_date']
-        ))
-
-    # Commit changes to the database
-    conn.commit()
-
-
-    for (location, cover), subdf in sensor_data_final.groupby(['sensor_location', 'sensor_cover']):
+
+    # Persist the metrics in one transaction, re-running on the same day replaces that day's rows
+    lap('detailed/save_metrics')
+    save_metrics(metrics_df)
+
+
+    # One plot per site from its DT and RAD series, no sensor's full history is needed any more
+    lap('detailed/plots')
+    # Rendered at PLOT_PPI once scaled to the page, as palette PNG or JPEG (PLOT_FORMAT)
+    dpi = plot_dpi(CONFIG.get('PLOT_PPI', DEFAULT_PLOT_PPI))
+    plot_extension = 'jpg' if CONFIG.get('PLOT_FORMAT', 'png') == 'jpeg' else 'png'
+    plot_jobs = []
+    for (location, cover), series in site_series.items():
         print(f"Plotting {(location, cover)}")
-        
-        # Create the first plot: Depth vs DateTime with dual y-axis for RAD and DT
-        dt_data = subdf[subdf['sensor_type'] == 'DT']
-        rad_data = subdf[subdf['sensor_type'] == 'RAD']
-
-        if not dt_data.empty and not rad_data.empty:
-            fig, ax1 = plt.subplots()
-
-            ax1.plot(dt_data['datetime'], dt_data['depth'], 'b-', label='DT Depth')
-            ax1.set_xlabel('DateTime')
-            ax1.set_ylabel('Depth (DT)', color='b')
-            ax1.tick_params('y', colors='b')
-
-            ax2 = ax1.twinx()
-            ax2.plot(rad_data['datetime'], rad_data['depth'], 'r-', label='RAD Depth')
-            ax2.set_ylabel('Depth (RAD)', color='r')
-            ax2.tick_params('y', colors='r')
-
-            plt.title(f'{location} {cover}')
-            ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            fig.autofmt_xdate(rotation=45)
-            plt.savefig(f'plots/plot_depth_{location}_{cover}.png', dpi=300)
-            plt.close()
-
-        elif not dt_data.empty:
-            plt.figure()
-            plt.plot(dt_data['datetime'], dt_data['depth'], 'b-', label='DT Depth')
-            plt.xlabel('DateTime')
-            plt.ylabel('Depth (DT)', color='b')
-            plt.title(f'{location} {cover}')
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            plt.gcf().autofmt_xdate(rotation=45)
-            plt.savefig(f'plots/plot_depth_{location}_{cover}.png', dpi=300)
-            plt.close()
-
-        elif not rad_data.empty:
-            plt.figure()
-            plt.plot(rad_data['datetime'], rad_data['depth'], 'r-', label='RAD Depth')
-            plt.xlabel('DateTime')
-            plt.ylabel('Depth (RAD)', color='r')
-            plt.title(f'{location} {cover}')
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            plt.gcf().autofmt_xdate(rotation=45)
-            plt.savefig(f'plots/plot_depth_{location}_{cover}.png', dpi=300)
-            plt.close()
-        
+        plot_jobs.append(PlotJob(location, cover, series.get('DT'), series.get('RAD'), f'plots/plot_depth_{location}_{cover}.{plot_extension}', dpi))
+    del site_series
+
+    # Render in parallel (plots of unchanged data come from the cache), then add the plots in site order
+    plot_cache_dir = 'plots/cache' if CONFIG.get('PLOT_CACHE', True) else None
+    plot_paths = render_plots(plot_jobs, max_workers=CONFIG.get('PLOT_WORKERS'), cache_dir=plot_cache_dir)
+    if plot_cache_dir is not None:
+        evict_plot_cache(plot_cache_dir, CONFIG.get('PLOT_CACHE_MAX_AGE_DAYS', 30), CONFIG.get('PLOT_CACHE_MAX_MB', 500))
+    lap('detailed/pdf')
+    for plot_path in plot_paths:
+        if plot_path is None:
+            continue
         # Add the first plot to a new page in the PDF
         pdf.add_page()
-        pdf.image(f'plots/plot_depth_{location}_{cover}.png', x=10, y=10, w=pdf.w - 20)
+        pdf.image(plot_path, x=10, y=10, w=pdf.w - 20)
 
     # Save PDF
     pdf.output(pdf_output_path)
-    print(f"Report saved to {pdf_output_path}")
+    pdf_size = os.path.getsize(pdf_output_path)
+    event('pdf', pdf_output_path, 0, bytes=pdf_size)
+    print(f"Report saved to {pdf_output_path} ({pdf_size / 1024:.0f} KB)")
+    checkpoint.save('get_reports')
+    lap()
 
     ############################################################ END GENERATE DETAILED REPORT ########################################################
 
@@ -0,0 +1,126 @@
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from metrics import SENSOR_KEYS
+from metrics_db import DB_PATH, connect
+
+
+# Fewer battery readings than this are not enough for a trend
+MIN_POINTS = 3
+
+# Crossings further out than this are not projected
+HORIZON_DAYS = 365
+
+
+def load_history(start, end, path=DB_PATH):
+    """Daily metrics rows with start <= report_date <= end (YYYY-MM-DD), read through the report_date index"""
+    with closing(connect(path)) as conn:
+        return pd.read_sql_query(
+            '''
+            SELECT sensor_location, sensor_cover, sensor_type, last_timestamp_recorded, current_battery_level, report_date
+            FROM detailed_report_metrics
+            WHERE report_date BETWEEN ? AND ?
+            ORDER BY sensor_location, sensor_cover, sensor_type, report_date
+            ''',
+            conn,
+            params=(start, end)
+        )
+
+
+def battery_trends(history, min_points=MIN_POINTS):
+    """
+    Least-squares line of battery level against time for every sensor, fitted for all sensors at once.
+
+    Each sensor's readings are taken at their last_timestamp_recorded, unreadable (-88) and repeated readings of a
+    stale sensor are dropped. Returns one row per sensor with SENSOR_KEYS, points, slope_per_day, latest (the
+    fitted level at the last reading) and last_reading.
+    """
+    readings = history.assign(
+        t=pd.to_datetime(history['last_timestamp_recorded'], errors='coerce'),
+        y=pd.to_numeric(history['current_battery_level'], errors='coerce')
+    )
+    readings = readings[readings['t'].notna() & readings['y'].notna() & (readings['y'] != -88)]
+    readings = readings.drop_duplicates(SENSOR_KEYS + ['t'])
+    columns = SENSOR_KEYS + ['points', 'slope_per_day', 'latest', 'last_reading']
+    if readings.empty:
+        # Typed like a fitted frame, so crossing_date still gets datetimes and floats
+        return pd.DataFrame({
+            **{k: pd.Series(dtype=object) for k in SENSOR_KEYS},
+            'points': pd.Series(dtype='int64'),
+            'slope_per_day': pd.Series(dtype=float),
+            'latest': pd.Series(dtype=float),
+            'last_reading': pd.Series(dtype='datetime64[ns]')
+        })
+
+    # Days relative to the newest reading keep the sums small and make the intercept the latest fitted level
+    last_reading = readings['t'].max()
+    x = (readings['t'] - last_reading) / pd.Timedelta(days=1)
+    sums = pd.DataFrame({
+        'n': 1,
+        'x': x,
+        'y': readings['y'],
+        'xx': x * x,
+        'xy': x * readings['y']
+    }).groupby([readings[k] for k in SENSOR_KEYS]).agg(
+        n=('n', 'sum'), x=('x', 'sum'), y=('y', 'sum'), xx=('xx', 'sum'), xy=('xy', 'sum')
+    )
+    sums['last_x'] = x.groupby([readings[k] for k in SENSOR_KEYS]).max()
+    sums = sums[sums['n'] >= min_points]
+
+    denominator = sums['n'] * sums['xx'] - sums['x'] ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (sums['n'] * sums['xy'] - sums['x'] * sums['y']) / denominator, np.nan)
+    # A flat battery comes out as +-1e-15 from the sums, don't project it
+    slope = np.round(slope, 6)
+    intercept = (sums['y'] - slope * sums['x']) / sums['n']
+
+    trends = pd.DataFrame({
+        'points': sums['n'],
+        'slope_per_day': slope,
+        'latest': intercept + slope * sums['last_x'],
+        'last_reading': (last_reading + pd.to_timedelta(sums['last_x'], unit='D')).dt.round('s')
+    }, index=sums.index).reset_index()
+    return trends[columns]
+
+
+def crossing_date(trends, limit, horizon_days=HORIZON_DAYS):
+    """Date the fitted line of each sensor reaches limit, NaT when it is not draining, already below or beyond the horizon"""
+    draining = (trends['slope_per_day'] < 0) & (trends['latest'] > limit)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(draining, (limit - trends['latest']) / trends['slope_per_day'], np.nan)
+    days = np.where(days <= horizon_days, days, np.nan)
+    return trends['last_reading'] + pd.to_timedelta(days, unit='D')
+
+
+def battery_forecast(days, low_limit, critical_limit, today, path=DB_PATH):
+    """Battery trends of the last days of metrics with the projected dates they reach low_limit and critical_limit"""
+    start = (pd.Timestamp(today) - pd.Timedelta(days=days)).strftime('%Y-%m-%d')
+    trends = battery_trends(load_history(start, pd.Timestamp(today).strftime('%Y-%m-%d'), path))
+    return trends.assign(
+        low_date=crossing_date(trends, low_limit),
+        critical_date=crossing_date(trends, critical_limit)
+    )
+
+
+def _projected(date, latest, limit):
+    if pd.notna(date):
+        return f"on {date.strftime('%Y-%m-%d')}"
+    if latest <= limit:
+        return 'already reached'
+    return f"not within {HORIZON_DAYS} days"
+
+
+def forecast_text(forecast, low_limit, critical_limit):
+    """One line per draining sensor, soonest critical date first"""
+    draining = forecast[forecast['slope_per_day'] < 0].sort_values(['critical_date', 'low_date'], na_position='last')
+    lines = []
+    for _, row in draining.iterrows():
+        low = _projected(row['low_date'], row['latest'], low_limit)
+        critical = _projected(row['critical_date'], row['latest'], critical_limit)
+        lines.append(
+            f"{row['sensor_location']} {row['sensor_cover']} {row['sensor_type']}: {row['latest']:.1f} now, "
+            f"{row['slope_per_day']:.2f} per day. LOW {low}, CRITICAL {critical}"
+        )
+    return "\n".join(lines)
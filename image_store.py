@@ -0,0 +1,162 @@
+from contextlib import closing
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from metrics_db import DB_PATH, connect
+
+
+# Images above this size (kb) are left out of the quality check
+MAX_IMAGE_KB = 100
+
+# Unit suffixes of the sizes in an Apache listing, sizes without one are in bytes
+SIZE_UNITS = {'K': 1, 'M': 1024, 'G': 1024 ** 2}
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _utc(now=None):
+    # Naive UTC, like the listing times once shifted (see get_raw_data.listing_time)
+    now = pd.Timestamp(now if now is not None else datetime.now(timezone.utc))
+    return now.tz_convert('UTC').tz_localize(None) if now.tzinfo is not None else now
+
+
+def parse_size_kb(sizes):
+    """Sizes as listed (e.g. 512, 45K, 1.2M) in kb, rounded to 0.1 kb, NaN where unreadable"""
+    sizes = pd.Series(sizes, dtype=str).str.strip().str.upper()
+    scale = sizes.str[-1].map(SIZE_UNITS)
+    number = pd.to_numeric(sizes.where(scale.isna(), sizes.str[:-1]), errors='coerce')
+    return (number * scale.fillna(1 / 1024)).round(1)
+
+
+def known_sites(path=DB_PATH):
+    """Sites with images in the store"""
+    with closing(connect(path)) as conn:
+        return {x for (x,) in conn.execute('SELECT DISTINCT site FROM image_size_counts')}
+
+
+def update_images(site, images, now=None, path=DB_PATH):
+    """
+    Bring the stored images of a site in line with its current listing. Returns how many images were new.
+
+    images has img_filename, size (as listed) and modified (naive UTC, NaT where unknown) columns, the whole
+    listing of the site. Listed images that are not in the store yet are stored and added to the size counts, an
+    image is counted in the hour of its modified time, or of now when it is unknown. Stored images that are no
+    longer listed (removed from the camera's folder) are deleted and taken off the counts, so the counts are
+    always those of the images currently listed.
+    """
+    now = _utc(now)
+    images = images.drop_duplicates('img_filename')
+    modified = pd.to_datetime(images['modified']).fillna(now)
+    rows = list(zip(
+        images['img_filename'],
+        parse_size_kb(images['size']).astype(object).where(lambda x: x.notna(), None),
+        modified.dt.strftime(TIMESTAMP_FORMAT),
+        modified.dt.floor('h').dt.strftime(TIMESTAMP_FORMAT)
+    ))
+    with closing(connect(path)) as conn, conn:
+        conn.execute('CREATE TEMP TABLE listed_images (img_filename TEXT PRIMARY KEY, size_kb REAL, modified TEXT, hour TEXT)')
+        conn.executemany('INSERT INTO listed_images VALUES (?, ?, ?, ?)', rows)
+
+        # Stored images no longer listed, with the hour they were counted in
+        conn.execute(
+            '''
+            CREATE TEMP TABLE changed_images AS
+            SELECT img_filename, size_kb, substr(modified, 1, 13) || ':00:00' AS hour, -1 AS change FROM image_metadata m
+            WHERE site = ? AND NOT EXISTS (SELECT 1 FROM listed_images l WHERE l.img_filename = m.img_filename)
+            ''',
+            (site,)
+        )
+        removed = conn.execute('SELECT COUNT(*) FROM changed_images').fetchone()[0]
+        conn.execute(
+            'DELETE FROM image_metadata WHERE site = ? AND img_filename IN (SELECT img_filename FROM changed_images)',
+            (site,)
+        )
+
+        # Listed images not stored yet
+        conn.execute(
+            '''
+            INSERT INTO changed_images
+            SELECT img_filename, size_kb, hour, 1 FROM listed_images l
+            WHERE NOT EXISTS (SELECT 1 FROM image_metadata m WHERE m.site = ? AND m.img_filename = l.img_filename)
+            ''',
+            (site,)
+        )
+        conn.execute(
+            '''
+            INSERT INTO image_metadata (site, img_filename, size_kb, modified, first_seen)
+            SELECT ?, img_filename, size_kb, modified, ? FROM listed_images
+            WHERE img_filename IN (SELECT img_filename FROM changed_images WHERE change = 1)
+            ORDER BY rowid
+            ''',
+            (site, now.strftime(TIMESTAMP_FORMAT))
+        )
+        new_images = conn.execute('SELECT COUNT(*) FROM changed_images WHERE change = 1').fetchone()[0]
+
+        # Both are applied to the counts in one upsert each, sizes with no images left are dropped
+        conn.execute(
+            '''
+            INSERT INTO image_size_counts (site, size_kb, count)
+            SELECT ?, size_kb, SUM(change) FROM changed_images WHERE size_kb IS NOT NULL GROUP BY size_kb
+            ON CONFLICT (site, size_kb) DO UPDATE SET count = count + excluded.count
+            ''',
+            (site,)
+        )
+        conn.execute(
+            '''
+            INSERT INTO image_hourly_size_counts (site, hour, size_kb, count)
+            SELECT ?, hour, size_kb, SUM(change) FROM changed_images WHERE size_kb IS NOT NULL GROUP BY hour, size_kb
+            ON CONFLICT (site, hour, size_kb) DO UPDATE SET count = count + excluded.count
+            ''',
+            (site,)
+        )
+        conn.execute('DELETE FROM image_size_counts WHERE site = ? AND count <= 0', (site,))
+        conn.execute('DELETE FROM image_hourly_size_counts WHERE site = ? AND count <= 0', (site,))
+        conn.execute('DROP TABLE listed_images')
+        conn.execute('DROP TABLE changed_images')
+    if removed:
+        print(f"{removed} images no longer listed")
+    return new_images
+
+
+def hq_stats(counts, image_quality_threshold):
+    """
+    percent_hq_images and max_image_size of every site from its (site, size_kb, count) rows.
+
+    Only images up to MAX_IMAGE_KB count. An image is high quality when it is at least image_quality_threshold of
+    the largest of them.
+    """
+    counts = counts[counts['size_kb'] <= MAX_IMAGE_KB]
+    max_size = counts.groupby('site')['size_kb'].max()
+    hq = counts['size_kb'] >= image_quality_threshold * counts['site'].map(max_size)
+    images = counts.groupby('site')['count'].sum()
+    hq_images = counts['count'].where(hq, 0).groupby(counts['site']).sum()
+    return pd.DataFrame({
+        'percent_hq_images': (hq_images / images * 100).round().astype('Int64'),
+        'max_image_size': max_size
+    })
+
+
+def quality_stats(image_quality_threshold, windows=(), now=None, path=DB_PATH):
+    """
+    Image quality of every site over all its listed images and over each lookback window (e.g. '24h', '7d').
+
+    Read from the size counts, so the cost does not grow with the number of images. Windows start on the hour.
+    Returns a frame indexed by site with percent_hq_images, max_image_size and a percent_hq_images_<window>
+    column for each window (NA when the site has no images in it).
+    """
+    now = _utc(now)
+    with closing(connect(path)) as conn:
+        stats = hq_stats(pd.read_sql_query('SELECT site, size_kb, count FROM image_size_counts', conn), image_quality_threshold)
+        for window in windows:
+            since = (now - pd.Timedelta(window)).floor('h').strftime(TIMESTAMP_FORMAT)
+            counts = pd.read_sql_query(
+                '''
+                SELECT site, size_kb, SUM(count) AS count FROM image_hourly_size_counts
+                WHERE hour >= ? GROUP BY site, size_kb
+                ''',
+                conn,
+                params=(since,)
+            )
+            stats[f'percent_hq_images_{window}'] = hq_stats(counts, image_quality_threshold)['percent_hq_images'].reindex(stats.index)
+    return stats
@@ -0,0 +1,267 @@
+"""
+Mail the reports over one reused SMTP session, streaming each message to the socket.
+
+    python mailer.py --server 127.0.0.1:8025 --from a@b --to c@d reports/*.pdf
+
+sends a test message, e.g. to a local stand-in started with python -m aiosmtpd -n -l 127.0.0.1:8025
+(pip install aiosmtpd).
+"""
+import argparse
+import atexit
+import base64
+import os
+import smtplib
+import tempfile
+import uuid
+import zipfile
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP
+from email.utils import COMMASPACE, formatdate
+
+
+# Attachments above this in total are zipped, and linked instead when they still don't fit
+DEFAULT_MAX_ATTACHMENT_MB = 10
+
+# Bytes base64 encodes into whole 76 character lines
+CHUNK_BYTES = 57 * 1024
+
+# Bytes collected before they are sent to the socket
+SEND_BUFFER = 64 * 1024
+
+
+class FileAttachment(MIMEBase):
+    """An attachment whose file is only read, in chunks, when the message is written"""
+
+    def __init__(self, path, filename=None):
+        filename = filename or os.path.basename(path)
+        super().__init__('application', 'zip' if filename.endswith('.zip') else 'octet-stream', policy=SMTP, name=filename)
+        self['Content-Transfer-Encoding'] = 'base64'
+        self['Content-Disposition'] = f'attachment; filename="{filename}"'
+        self.path = path
+
+
+class StreamingGenerator(BytesGenerator):
+    """
+    BytesGenerator that writes multipart messages and FileAttachment parts straight to its output.
+
+    The stock generator renders every part into a buffer before writing it (to pick a boundary no part contains and
+    to fix up headers), so a message is held in memory whole. Here the multipart boundary is set up front and files
+    are base64 encoded chunk by chunk as they are written.
+    """
+
+    def _write(self, msg):
+        if isinstance(msg, FileAttachment):
+            self._write_headers(msg)
+            with open(msg.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+                    self.write(base64.encodebytes(chunk).decode('ascii').replace('\n', self._NL))
+        elif msg.is_multipart() and msg.get_boundary() is not None:
+            self._write_headers(msg)
+            boundary = msg.get_boundary()
+            for part in msg.get_payload():
+                self.write('--' + boundary + self._NL)
+                self.clone(self._fp).flatten(part, linesep=self._NL)
+                self.write(self._NL)
+            self.write('--' + boundary + '--' + self._NL)
+        else:
+            super()._write(msg)
+
+
+class DataStream:
+    """File object for the generator, sends the message to the SMTP socket dot-stuffed (RFC 5321 4.5.2)"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.line_start = True
+
+    def write(self, data):
+        if not data:
+            return
+        stuffed = data.replace(b'\n.', b'\n..')
+        if self.line_start and stuffed.startswith(b'.'):
+            stuffed = b'.' + stuffed
+        self.line_start = data.endswith(b'\n')
+        self.buffer += stuffed
+        if len(self.buffer) >= SEND_BUFFER:
+            self.flush()
+
+    def flush(self):
+        self.sock.sendall(self.buffer)
+        self.buffer.clear()
+
+    def end(self):
+        # The message ends with a line holding a single dot
+        self.buffer += b'.\r\n' if self.line_start else b'\r\n.\r\n'
+        self.flush()
+
+
+def zip_file(path, directory):
+    zip_path = os.path.join(directory, f"{os.path.basename(path)}.zip")
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as f:
+        f.write(path, os.path.basename(path))
+    return zip_path
+
+
+def plan_attachments(files, max_bytes, directory):
+    """
+    Split files into (attachments, too_large) so the attachments add up to at most max_bytes.
+
+    A file that doesn't fit in what is left is zipped into directory and attached zipped if that fits, otherwise
+    it goes to too_large. Files keep their order.
+    """
+    attachments = []
+    too_large = []
+    left = max_bytes
+    for path in files:
+        attachment = path
+        size = os.path.getsize(path)
+        if size > left:
+            attachment = zip_file(path, directory)
+            size = os.path.getsize(attachment)
+        if size <= left:
+            attachments.append(attachment)
+            left -= size
+        else:
+            too_large.append(path)
+    return attachments, too_large
+
+
+def link_text(paths, link_url=None):
+    # Where the recipients find the reports that were not attached
+    lines = []
+    for path in paths:
+        name = os.path.basename(path)
+        size = os.path.getsize(path) / 2**20
+        if link_url:
+            lines.append(f"{name} ({size:.1f} MB): {link_url.rstrip('/')}/{name}")
+        else:
+            lines.append(f"{name} ({size:.1f} MB) is too large to attach, it is at {os.path.abspath(path)} on the report server")
+    return '\n\nNot attached:\n' + '\n'.join(lines) if lines else ''
+
+
+class Mailer:
+    """
+    Sends messages over one SMTP session to server ('host' or 'host:port'), opened on the first send.
+
+    The session is checked with NOOP before each send and opened again if the server dropped it, so a long running
+    process (the daemon) can keep one Mailer.
+    """
+
+    def __init__(self, server='localhost', timeout=60):
+        self.server = server
+        self.timeout = timeout
+        self.sessions = 0  # SMTP connections opened, one per Mailer unless the server drops it
+        self._smtp = None
+
+    def _session(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self._smtp = smtplib.SMTP(self.server, timeout=self.timeout)
+        self._smtp.ehlo_or_helo_if_needed()
+        self.sessions += 1
+        return self._smtp
+
+    def send(self, send_from, send_to, subject, text, files=None, max_attachment_mb=DEFAULT_MAX_ATTACHMENT_MB, link_url=None):
+        """
+        Mail text with files attached. Attachments above max_attachment_mb in total (None for no limit) are zipped
+        and, if they still don't fit, replaced in the text by a link under link_url (or their path on this machine).
+        """
+        with tempfile.TemporaryDirectory(prefix='mail_') as directory:
+            max_bytes = max_attachment_mb * 2**20 if max_attachment_mb is not None else float('inf')
+            attachments, too_large = plan_attachments(files or [], max_bytes, directory)
+
+            # Built with the policy it is written with, so non-ASCII headers are encoded when they are set
+            msg = MIMEMultipart(boundary=f"=={uuid.uuid4().hex}==", policy=SMTP)
+            msg['From'] = send_from
+            msg['To'] = COMMASPACE.join(send_to)
+            msg['Date'] = formatdate(localtime=True)
+            msg['Subject'] = subject
+            msg.attach(MIMEText(text + link_text(too_large, link_url), policy=SMTP))
+            for path in attachments:
+                msg.attach(FileAttachment(path))
+
+            smtp = self._session()
+            try:
+                self._transfer(smtp, send_from, send_to, msg)
+            except Exception:
+                # The session is in an unknown state, the next send opens a new one
+                self.close()
+                raise
+
+    def _transfer(self, smtp, send_from, send_to, msg):
+        code, response = smtp.mail(send_from)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, send_from)
+        refused = {}
+        for address in send_to:
+            code, response = smtp.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, response)
+        if len(refused) == len(send_to):
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, response = smtp.docmd('DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        stream = DataStream(smtp.sock)
+        StreamingGenerator(stream, policy=SMTP).flatten(msg)
+        stream.end()
+        code, response = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        for address, (code, response) in refused.items():
+            print(f"Mail to {address} refused: {code} {response}")
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+# One Mailer per server for the whole process, closed when it exits
+_MAILERS = {}
+
+
+def get_mailer(server='localhost'):
+    if server not in _MAILERS:
+        _MAILERS[server] = Mailer(server)
+    return _MAILERS[server]
+
+
+@atexit.register
+def close_mailers():
+    for mailer in _MAILERS.values():
+        mailer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--server', default='127.0.0.1:8025')
+    parser.add_argument('--from', dest='send_from', default='report@localhost')
+    parser.add_argument('--to', nargs='+', default=['test@localhost'])
+    parser.add_argument('--max-attachment-mb', type=float, default=DEFAULT_MAX_ATTACHMENT_MB)
+    parser.add_argument('--link-url')
+    args = parser.parse_args()
+
+    mailer = Mailer(args.server)
+    mailer.send(args.send_from, args.to, 'Mailer test', 'Test message', args.files, args.max_attachment_mb, args.link_url)
+    mailer.close()
+    print(f"Sent to {', '.join(args.to)} through {args.server}")
+
+
+if __name__ == '__main__':
+    main()
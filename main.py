@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 import pytz
@@ -7,6 +8,8 @@ import traceback
 from utils import send_mail
 from get_raw_data import get_raw_data
 from get_reports import get_reports
+from checkpoint import Checkpoint
+from timing import TRACE, stage, profiled
 
 def send_error_report(subject, text, send_from, send_to, server):
     send_mail(send_from, send_to, subject, text, files=None, server=server)
@@ -16,31 +19,59 @@ send_from = CONFIG.get('MAIL_FROM')
 send_to = CONFIG.get('MAIL_TO')
 server = CONFIG.get('MAIL_SERVER')
 
-try:
-    get_raw_data()
-except Exception as e:
-    subject = 'ERROR: IDDE Health Report'
-    text = f'There was an error in get_raw_data function.\n\n{traceback.format_exc()}'
-    send_error_report(subject, text, send_from, send_to, server)
-    raise
-
-try:
-    get_reports()
-except Exception as e:
-    subject = 'ERROR: IDDE Health Report'
-    text = f'There was an error in get_reports function.\n\n{traceback.format_exc()}'
-    send_error_report(subject, text, send_from, send_to, server)
-    raise
-
-# Only run when no errors for both functions
-subject = 'IDDE Health Report'
-text = 'See attachments'
-pst = pytz.timezone('US/Pacific')
-today = datetime.now(pst)
-todayyear = today.year
-todaymonth = today.month
-todaydate = today.day
-files = [x for x in os.listdir(os.path.join(os.getcwd(), "reports")) if f"{todayyear}-{todaymonth}-{todaydate}.pdf" in x]
-file_paths = [os.path.join(os.getcwd(), "reports", x) for x in files]
-
-send_mail(send_from, send_to, subject, text, files=file_paths, server=server)
+def run_step(step, *args, **kwargs):
+    # Run one stage, mail the traceback if it fails
+    try:
+        return step(*args, **kwargs)
+    except Exception as e:
+        subject = 'ERROR: IDDE Health Report'
+        text = f'There was an error in {step.__name__} function.\n\n{traceback.format_exc()}'
+        if CONFIG.get('CHECKPOINT_ENABLED', True):
+            text += '\nRun main.py again to resume from the last finished step, or with --force to start over.'
+        send_error_report(subject, text, send_from, send_to, server)
+        raise
+
+def send_reports():
+    subject = 'IDDE Health Report'
+    text = 'See attachments'
+    pst = pytz.timezone('US/Pacific')
+    today = datetime.now(pst)
+    todayyear = today.year
+    todaymonth = today.month
+    todaydate = today.day
+    files = [x for x in os.listdir(os.path.join(os.getcwd(), "reports")) if f"{todayyear}-{todaymonth}-{todaydate}.pdf" in x]
+    file_paths = [os.path.join(os.getcwd(), "reports", x) for x in files]
+
+    # Reports above MAIL_MAX_ATTACHMENT_MB are zipped, or linked under MAIL_LINK_URL when they still don't fit
+    send_mail(send_from, send_to, subject, text, files=file_paths, server=server,
+              max_attachment_mb=CONFIG.get('MAIL_MAX_ATTACHMENT_MB', 10), link_url=CONFIG.get('MAIL_LINK_URL'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the sensor data, build the reports and mail them.')
+    parser.add_argument('--force', action='store_true', help="start over, ignoring what a failed run of today finished")
+    args = parser.parse_args()
+
+    # A run that fails resumes where it stopped when started again on the same (US/Pacific) day
+    checkpoint = Checkpoint(datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%d'), enabled=CONFIG.get('CHECKPOINT_ENABLED', True))
+    if args.force:
+        checkpoint.clear()
+    elif checkpoint.resumed:
+        print(f"Resuming today's run, {checkpoint.resumed} steps already done (--force to start over)")
+
+    # Each run writes a trace of its stage durations to data/traces, PROFILE adds a cProfile/pyinstrument dump
+    TRACE.start('main')
+    try:
+        with profiled('main', CONFIG.get('PROFILE')):
+            with stage('get_raw_data'):
+                run_step(get_raw_data, checkpoint=checkpoint)
+            with stage('get_reports'):
+                run_step(get_reports, checkpoint=checkpoint)
+
+            # Only run when no errors for both functions
+            with stage('send_reports'):
+                send_reports()
+            # The run is complete, the next one starts over
+            checkpoint.clear()
+    finally:
+        if CONFIG.get('TRACE_ENABLED', True):
+            TRACE.write()
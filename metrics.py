@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from rules import load_rules, resolve_columns, rule_columns, rule_masks
+
+
+SENSOR_KEYS = ['sensor_location', 'sensor_cover', 'sensor_type']
+
+# Sensor columns the summary metrics are computed from, besides the columns of the value range rules
+METRIC_COLUMNS = ['datetime', 'Batt']
+
+
+def build_long_frame(sensor_frames, rules=None):
+    """
+    Stack the sensor data of every sensor into one long frame.
+
+    sensor_frames yields ((sensor_location, sensor_cover, sensor_type), sensor_data) with sensor_data sorted by
+    datetime. Only METRIC_COLUMNS and the columns of the rules (under their first alias) are kept, as float
+    except datetime. Each sensor is numbered by 'sensor_id' and its rows stay contiguous.
+    """
+    rules = rules if rules is not None else load_rules()
+    value_columns = [x for x in rule_columns(rules) if x not in METRIC_COLUMNS]
+    keys = []
+    lengths = []
+    columns = {x: [] for x in METRIC_COLUMNS + value_columns}
+    for key, sensor_data in sensor_frames:
+        if sensor_data.empty:
+            continue
+        n = len(sensor_data)
+        keys.append(key)
+        lengths.append(n)
+        columns['datetime'].append(sensor_data['datetime'].to_numpy().astype('datetime64[ns]'))
+        if 'Batt' in sensor_data.columns:
+            columns['Batt'].append(pd.to_numeric(sensor_data['Batt'], errors='coerce').to_numpy(dtype=float, na_value=np.nan))
+        else:
+            columns['Batt'].append(np.full(n, np.nan))
+        values = resolve_columns(sensor_data, rules)
+        for column in value_columns:
+            columns[column].append(values[column] if column in values else np.full(n, np.nan))
+
+    sensors = pd.DataFrame(keys, columns=SENSOR_KEYS)
+    if not keys:
+        return sensors, pd.DataFrame(columns=list(columns) + ['sensor_id'])
+    long_frame = pd.DataFrame({x: np.concatenate(arrays) for x, arrays in columns.items()})
+    long_frame['sensor_id'] = np.repeat(np.arange(len(keys)), lengths)
+    return sensors, long_frame
+
+
+def _count(ids, mask, n):
+    return np.bincount(ids[mask], minlength=n)
+
+
+def _last_rows(ids):
+    # Rows of a sensor are contiguous and sorted by datetime, so its last row is where the next sensor starts
+    return np.r_[np.flatnonzero(ids[1:] != ids[:-1]), len(ids) - 1]
+
+
+def sensor_status(sensors, long_frame, critical_limit, low_limit, now):
+    """
+    Battery and 24 hour update status of every logger sensor, from its last rows in the long frame.
+
+    Returns one row per sensor with SENSOR_KEYS and battery_status, lowest_battery_value, last_updated_status and
+    last_updated_entry. The summary (logger_metrics) and the alerts both use it.
+    """
+    if len(sensors) == 0:
+        return sensors.assign(battery_status=[], lowest_battery_value=[], last_updated_status=[], last_updated_entry=[])
+
+    ids = long_frame['sensor_id'].to_numpy()
+    last_rows = _last_rows(ids)
+
+    # Battery Check
+    batt = np.nan_to_num(long_frame['Batt'].to_numpy(dtype=float), nan=-88)
+    latest_batt = batt[last_rows]
+    readable = batt != -88
+    latest_readable = pd.Series(batt[readable]).groupby(ids[readable]).last().reindex(range(len(sensors))).to_numpy()
+    battery_status = np.select(
+        [
+            (latest_batt != -88) & (latest_batt < critical_limit),
+            (latest_batt != -88) & (critical_limit <= latest_batt) & (latest_batt <= low_limit),
+            (latest_batt != -88) & (latest_batt > low_limit)
+        ],
+        ['CRITICAL', 'LOW', 'OK'],
+        default=np.array([f"Latest value cannot be read - Latest readable value: {x}" for x in latest_readable], dtype=object)
+    )
+
+    # Last Updated Check
+    last_modified = long_frame['datetime'].to_numpy()[last_rows]
+    updated = (pd.Timestamp(now).to_datetime64() - last_modified) <= np.timedelta64(24, 'h')
+
+    return sensors.assign(
+        battery_status=battery_status,
+        lowest_battery_value=latest_batt,
+        last_updated_status=np.where(updated, 'YES', 'NO'),
+        last_updated_entry=pd.to_datetime(last_modified)
+    )
+
+
+def logger_metrics(sensors, long_frame, critical_limit, low_limit, expected_timepoints, now, since, rules=None):
+    """
+    Summary metrics of every logger sensor in one vectorized pass over the long frame.
+
+    Returns one row per sensor with the sensor_status columns, percent_missing and value_status, the same values
+    the per-sensor loop produced.
+    """
+    n = len(sensors)
+    status = sensor_status(sensors, long_frame, critical_limit, low_limit, now)
+    if n == 0:
+        return status.assign(percent_missing=[], value_status=[])
+
+    ids = long_frame['sensor_id'].to_numpy()
+    updated = status['last_updated_status'].to_numpy() == 'YES'
+
+    # Missing data in the last 24 hours
+    recent = _count(ids, long_frame['datetime'].to_numpy() >= since, n)
+    percent = np.maximum(0, 100 - (recent / expected_timepoints) * 100).round().astype(int)
+    percent_missing = np.where(
+        updated,
+        percent.astype(object),
+        "Cannot be determined - Data was not available for the last within 24 hours."
+    )
+
+    # Value range checks, every rule evaluated in one pass over the long frame
+    rules = rules if rules is not None else load_rules()
+    sensor_type = sensors['sensor_type'].to_numpy()
+    texts = []
+    for rule, mask in zip(rules, rule_masks(long_frame, rules, sensor_type[ids])):
+        bad = _count(ids, mask, n)
+        texts.append(np.where(bad > 0, pd.Series(bad).map(lambda x, rule=rule: rule.message.format(count=x)), ''))
+    value_status = np.array(['; '.join(x for x in row if x) for row in zip(*texts)] if texts else [''] * n, dtype=object)
+
+    return status.assign(percent_missing=percent_missing, value_status=value_status)
+
+
+def image_metrics(metadata_images, image_stats, critical_limit, low_limit, today):
+    """
+    Summary metrics of every CAM site, one row per site.
+
+    metadata_images has the site rows of the image listing (data_location, last_modified, latest_battery_level) and
+    image_stats the image quality of each data_location (see image_store.quality_stats).
+    """
+    images = metadata_images.assign(last_modified=pd.to_datetime(metadata_images['last_modified']))
+    groups = images.groupby(SENSOR_KEYS)
+    sites = groups.agg(
+        last_modified=('last_modified', 'first'),
+        data_location=('data_location', 'first')
+    )
+    quality = image_stats.reindex(sites['data_location'].to_numpy()).set_index(sites.index)
+
+    battery = groups['latest_battery_level'].first().reindex(sites.index).to_numpy()
+    readable = images[images['latest_battery_level'] != -88].groupby(SENSOR_KEYS)['latest_battery_level'].first().reindex(sites.index)
+    battery_status = np.select(
+        [
+            (battery != -88) & (battery <= critical_limit),
+            (critical_limit < battery) & (battery <= low_limit),
+            battery == -88
+        ],
+        ['CRITICAL', 'LOW', readable.astype(str).to_numpy()],
+        default='OK'
+    )
+
+    last_modified = sites['last_modified'].dt.tz_localize('UTC')
+    return pd.DataFrame({
+        'last_modified': last_modified,
+        'last_updated_status': np.where((today - last_modified) > pd.Timedelta(hours=24), 'NO', 'YES'),
+        'last_updated_entry': last_modified,
+        'data_location': sites['data_location'],
+        'lowest_battery_value': battery,
+        'battery_status': battery_status
+    }, index=sites.index).join(quality).reset_index()
@@ -0,0 +1,165 @@
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+
+DB_PATH = 'sensor_metrics.db'
+
+COLUMNS = [
+    'sensor_location',
+    'sensor_cover',
+    'sensor_type',
+    'last_timestamp_recorded',
+    'current_battery_level',
+    'missing_periods',
+    'value_status',
+    'problematic_timestamps',
+    'report_date'
+]
+KEY_COLUMNS = ['sensor_location', 'sensor_cover', 'sensor_type', 'report_date']
+
+
+def _migrate_1(conn):
+    # The table get_reports used to assume existed, created here if it does not
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS detailed_report_metrics (
+            sensor_location TEXT,
+            sensor_cover TEXT,
+            sensor_type TEXT,
+            last_timestamp_recorded TEXT,
+            current_battery_level REAL,
+            missing_periods TEXT,
+            value_status TEXT,
+            problematic_timestamps TEXT,
+            report_date TEXT
+        )
+    ''')
+    # report_date was written as e.g. 2024-6-5, make it YYYY-MM-DD so dates sort and range queries work
+    rows = conn.execute('SELECT DISTINCT report_date FROM detailed_report_metrics').fetchall()
+    for (report_date,) in rows:
+        normalized = pd.Timestamp(report_date).strftime('%Y-%m-%d')
+        if normalized != report_date:
+            conn.execute('UPDATE detailed_report_metrics SET report_date = ? WHERE report_date = ?', (normalized, report_date))
+    # Re-runs on the same day used to add duplicates, keep the last row of each sensor and day
+    conn.execute('''
+        DELETE FROM detailed_report_metrics WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM detailed_report_metrics GROUP BY sensor_location, sensor_cover, sensor_type, report_date
+        )
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_detailed_report_metrics_sensor_date
+        ON detailed_report_metrics (sensor_location, sensor_cover, sensor_type, report_date)
+    ''')
+
+
+def _migrate_2(conn):
+    # History queries select a range of report dates across all sensors
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detailed_report_metrics_date ON detailed_report_metrics (report_date)')
+
+
+def _migrate_3(conn):
+    # Last known state of every alerted check of a sensor, and the alerts sent (for rate limiting)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_alert_state (
+            sensor_location TEXT,
+            sensor_cover TEXT,
+            sensor_type TEXT,
+            check_name TEXT,
+            state TEXT,
+            changed_at TEXT,
+            PRIMARY KEY (sensor_location, sensor_cover, sensor_type, check_name)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_alert_log (
+            sensor_location TEXT,
+            sensor_cover TEXT,
+            sensor_type TEXT,
+            check_name TEXT,
+            old_state TEXT,
+            new_state TEXT,
+            sent_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sensor_alert_log_sensor
+        ON sensor_alert_log (sensor_location, sensor_cover, sensor_type, check_name, sent_at)
+    ''')
+
+
+def _migrate_4(conn):
+    # The images listed for a CAM site, and the count of its images of each size (kb), in total and per hour of
+    # their last modified time, so the quality check reads the counts instead of every image
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_metadata (
+            site TEXT,
+            img_filename TEXT,
+            size_kb REAL,
+            modified TEXT,
+            first_seen TEXT,
+            PRIMARY KEY (site, img_filename)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_size_counts (
+            site TEXT,
+            size_kb REAL,
+            count INTEGER,
+            PRIMARY KEY (site, size_kb)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_hourly_size_counts (
+            site TEXT,
+            hour TEXT,
+            size_kb REAL,
+            count INTEGER,
+            PRIMARY KEY (site, hour, size_kb)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_image_hourly_size_counts_hour ON image_hourly_size_counts (hour)')
+
+
+# Schema version -> migration, applied in order to bring PRAGMA user_version up to date
+MIGRATIONS = {
+    1: _migrate_1,
+    2: _migrate_2,
+    3: _migrate_3,
+    4: _migrate_4
+}
+
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target in sorted(MIGRATIONS):
+        if target <= version:
+            continue
+        with conn:
+            MIGRATIONS[target](conn)
+            conn.execute(f'PRAGMA user_version = {int(target)}')
+        print(f"Migrated the metrics database schema to version {target}")
+
+
+def connect(path=DB_PATH):
+    """Open the metrics database in WAL mode with its schema up to date"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    migrate(conn)
+    return conn
+
+
+def save_metrics(metrics_df, path=DB_PATH):
+    """Write the detailed report metrics of a run in one transaction, re-running a day replaces that day's rows"""
+    if metrics_df.empty:
+        return 0
+    records = metrics_df[COLUMNS].astype(object).where(metrics_df[COLUMNS].notna(), None)
+    rows = [tuple(x.item() if hasattr(x, 'item') else x for x in row) for row in records.itertuples(index=False)]
+    updates = ', '.join(f"{x} = excluded.{x}" for x in COLUMNS if x not in KEY_COLUMNS)
+    with closing(connect(path)) as conn, conn:
+        conn.executemany(f'''
+            INSERT INTO detailed_report_metrics ({', '.join(COLUMNS)})
+            VALUES ({', '.join('?' for _ in COLUMNS)})
+            ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}
+        ''', rows)
+    return len(rows)
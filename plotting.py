@@ -0,0 +1,218 @@
+import gc
+import hashlib
+import io
+import os
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Render to files only, no display needed in the worker processes
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from PIL import Image
+
+
+# One depth plot per (location, cover). dt and rad are (datetime array, depth array) or None, the path's
+# extension picks the format (.png or .jpg)
+PlotJob = namedtuple('PlotJob', ['location', 'cover', 'dt', 'rad', 'path', 'dpi'], defaults=[300])
+
+
+# Points kept per series, a min and a max per pixel column of a plot up to 2000 px wide
+DEFAULT_MAX_POINTS = 4000
+
+# Width of a plot on the detailed report's A4 pages (page width less the 10 mm margins)
+PAGE_PLOT_WIDTH_IN = 190 / 25.4
+
+# Pixels per inch of a plot once it is scaled to the page, sharp on screen and on office printers
+DEFAULT_PLOT_PPI = 150
+
+JPEG_QUALITY = 90
+
+
+def decimate_minmax(x, y, max_points=DEFAULT_MAX_POINTS):
+    """
+    Reduce a series to about max_points points by keeping the minimum and the maximum of equally sized buckets.
+
+    Every spike survives because each bucket keeps its extremes, and the kept points stay in their original order.
+    """
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return x, y
+    n_buckets = max(1, max_points // 2)
+    bucket_size = -(-n // n_buckets)
+    n_buckets = -(-n // bucket_size)
+
+    # Pad the last bucket so all buckets are one row of a 2D array, NaNs (and the padding) never win min or max
+    values = np.asarray(y, dtype=float)
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(n_buckets, bucket_size)
+    starts = np.arange(n_buckets) * bucket_size
+    lowest = starts + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highest = starts + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+
+    keep = np.unique(np.concatenate([lowest, highest, [0, n - 1]]))
+    keep = keep[keep < n]
+    return np.asarray(x)[keep], values[keep]
+
+
+def depth_series(sensor_data, max_points=DEFAULT_MAX_POINTS):
+    if sensor_data.empty or 'depth' not in sensor_data.columns:
+        return None
+    return decimate_minmax(sensor_data['datetime'].to_numpy(), sensor_data['depth'].to_numpy(), max_points)
+
+
+def plot_dpi(ppi=DEFAULT_PLOT_PPI):
+    """Figure dpi that gives ppi pixels per inch once the plot is scaled to PAGE_PLOT_WIDTH_IN"""
+    return ppi * PAGE_PLOT_WIDTH_IN / plt.rcParams['figure.figsize'][0]
+
+
+def save_plot(path, dpi):
+    """
+    Save the current figure for FPDF, as JPEG for a .jpg path and as a palette PNG otherwise.
+
+    FPDF copies the data of a palette or RGB PNG into the PDF as is. matplotlib's RGBA PNGs are split into color
+    and alpha pixel by pixel in Python and embedded as two images, which was most of the PDF's size and write time.
+    """
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', dpi=dpi)
+    image = Image.open(buffer).convert('RGB')
+    if path.endswith(('.jpg', '.jpeg')):
+        image.save(path, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    else:
+        # A few line colors and their anti-aliasing, 256 colors keep them exactly enough
+        image.quantize(256).save(path, format='PNG', optimize=True)
+
+
+def plot_depth(job):
+    """Render the depth plot of one site, returns the path of the image or None when the site has no DT/RAD data"""
+    location, cover, dt, rad, path, dpi = job
+
+    # Create the first plot: Depth vs DateTime with dual y-axis for RAD and DT
+    if dt is not None and rad is not None:
+        fig, ax1 = plt.subplots()
+
+        ax1.plot(dt[0], dt[1], 'b-', label='DT Depth')
+        ax1.set_xlabel('DateTime')
+        ax1.set_ylabel('Depth (DT)', color='b')
+        ax1.tick_params('y', colors='b')
+
+        ax2 = ax1.twinx()
+        ax2.plot(rad[0], rad[1], 'r-', label='RAD Depth')
+        ax2.set_ylabel('Depth (RAD)', color='r')
+        ax2.tick_params('y', colors='r')
+
+        plt.title(f'{location} {cover}')
+        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        fig.autofmt_xdate(rotation=45)
+
+    elif dt is not None:
+        plt.figure()
+        plt.plot(dt[0], dt[1], 'b-', label='DT Depth')
+        plt.xlabel('DateTime')
+        plt.ylabel('Depth (DT)', color='b')
+        plt.title(f'{location} {cover}')
+        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        plt.gcf().autofmt_xdate(rotation=45)
+
+    elif rad is not None:
+        plt.figure()
+        plt.plot(rad[0], rad[1], 'r-', label='RAD Depth')
+        plt.xlabel('DateTime')
+        plt.ylabel('Depth (RAD)', color='r')
+        plt.title(f'{location} {cover}')
+        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        plt.gcf().autofmt_xdate(rotation=45)
+
+    else:
+        return None
+
+    save_plot(path, dpi)
+    plt.close()
+    # The closed figure and its 300 dpi canvas sit in reference cycles, free them before the next site is drawn
+    gc.collect()
+    return path
+
+
+def _render(jobs, max_workers=None):
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(jobs) <= 1:
+        return [plot_depth(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        return list(executor.map(plot_depth, jobs))
+
+
+def render_plots(jobs, max_workers=None, cache_dir=None):
+    """
+    Render the plots in a process pool, returns the PNG paths in the order of jobs.
+
+    max_workers defaults to the number of cores, with 1 worker the plots are rendered in this process.
+    With a cache_dir, plots whose data and parameters were rendered before are copied from the cache instead.
+    """
+    jobs = list(jobs)
+    paths = [None] * len(jobs)
+    misses = []
+    for i, job in enumerate(jobs):
+        if job.dt is None and job.rad is None:
+            continue
+        if cache_dir is not None:
+            cached = os.path.join(cache_dir, plot_fingerprint(job) + os.path.splitext(job.path)[1])
+            if os.path.exists(cached):
+                shutil.copyfile(cached, job.path)
+                os.utime(cached)  # Recently used, keep it when evicting by age
+                paths[i] = job.path
+                continue
+        misses.append(i)
+
+    if cache_dir is not None:
+        print(f"Plot cache: {len(jobs) - len(misses)} reused, {len(misses)} to render")
+    for i, path in zip(misses, _render([jobs[i] for i in misses], max_workers)):
+        paths[i] = path
+        if cache_dir is not None and path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            cached = os.path.join(cache_dir, plot_fingerprint(jobs[i]) + os.path.splitext(jobs[i].path)[1])
+            shutil.copyfile(path, f"{cached}.tmp")
+            os.replace(f"{cached}.tmp", cached)
+    return paths
+
+
+# Bump when plot_depth draws differently, so cached plots are not reused
+PLOT_VERSION = 2
+
+
+def plot_fingerprint(job):
+    """Hash of everything that goes into a plot, its series and parameters"""
+    digest = hashlib.sha256(repr((PLOT_VERSION, job.location, job.cover, round(job.dpi, 3), os.path.splitext(job.path)[1])).encode())
+    for series in (job.dt, job.rad):
+        if series is None:
+            digest.update(b'none')
+            continue
+        for values in series:
+            values = np.ascontiguousarray(values)
+            digest.update(f"{values.dtype}:{len(values)}".encode())
+            digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def evict_plot_cache(cache_dir, max_age_days=30, max_mb=500):
+    """Delete cached plots not used for max_age_days, then the least recently used ones until the cache fits max_mb"""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        stat = os.stat(path)
+        if max_age_days is not None and time.time() - stat.st_mtime > max_age_days * 86400:
+            os.remove(path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(x[1] for x in entries)
+    for _, size, path in sorted(entries):
+        if max_mb is None or total <= max_mb * 1024 * 1024:
+            break
+        os.remove(path)
+        total -= size
@@ -0,0 +1,136 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+# A value range check.
+#   sensor_type     type (or list of types) the rule applies to
+#   columns         aliases of the checked column, the first one present in a frame is used
+#   predicate       {'below': x}, {'above': x}, {'equals': x} or {'outside': [low, high]}, a value is bad when it holds
+#   message         summary report text, {count} is the number of bad values
+#   detail_message  detailed report text, same as message when left out
+Rule = namedtuple('Rule', ['name', 'sensor_type', 'columns', 'predicate', 'message', 'detail_message'])
+
+DEFAULT_RULES = [
+    {
+        'name': 'angle',
+        'sensor_type': 'RAD',
+        'columns': ['ANGLE', 'angle'],
+        'predicate': {'outside': [75, 85]},
+        'message': 'Angle value (degrees) out of range (Normal range: [75,85]) - {count} bad values',
+        'detail_message': 'ANGLE VALUE OUT OF RANGE [75,85] - {count} bad values'
+    },
+    {
+        'name': 'turbwo',
+        'sensor_type': 'TURB',
+        'columns': ['turbwo', 'Turbwo', 'TURBwo'],
+        'predicate': {'above': 10},
+        'message': 'Turbidity without LED values out of range (Normal range: [0,10]) - {count} bad values',
+        'detail_message': 'TURBWO VALUE OUT OF RANGE [>10] - {count} bad values'
+    },
+    {
+        'name': 'ec',
+        'sensor_type': 'TURB',
+        'columns': ['EC', 'ec'],
+        'predicate': {'equals': 0},
+        'message': 'EC value is 0 - {count} bad values',
+        'detail_message': 'EC VALUE IS 0 - {count} bad values'
+    }
+]
+
+PREDICATES = {
+    'below': lambda values, x: values < x,
+    'above': lambda values, x: values > x,
+    'equals': lambda values, x: values == x,
+    'outside': lambda values, x: (values < x[0]) | (values > x[1])
+}
+
+
+def load_rules(config_rules=None):
+    """Rules from the VALUE_RULES list of config.json, DEFAULT_RULES when it is not set"""
+    rules = []
+    for x in (config_rules if config_rules is not None else DEFAULT_RULES):
+        unknown = set(x['predicate']) - set(PREDICATES)
+        if unknown:
+            raise ValueError(f"Rule {x.get('name')}: unknown predicate {', '.join(unknown)}")
+        sensor_type = x['sensor_type']
+        columns = x['columns']
+        rules.append(Rule(
+            name=x.get('name', columns if isinstance(columns, str) else columns[0]),
+            sensor_type=[sensor_type] if isinstance(sensor_type, str) else list(sensor_type),
+            columns=[columns] if isinstance(columns, str) else list(columns),
+            predicate=x['predicate'],
+            message=x['message'],
+            detail_message=x.get('detail_message', x['message'])
+        ))
+    return rules
+
+
+def rule_columns(rules):
+    """Column each rule is evaluated on once the aliases are resolved (its first alias), without repeats"""
+    return list(dict.fromkeys(rule.columns[0] for rule in rules))
+
+
+def resolve_columns(frame, rules):
+    """{first alias: values as floats} of every rule column present in frame under any of its aliases"""
+    values = {}
+    for rule in rules:
+        name = rule.columns[0]
+        if name in values:
+            continue
+        for alias in rule.columns:
+            if alias in frame.columns:
+                values[name] = pd.to_numeric(frame[alias], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                break
+    return values
+
+
+def rule_masks(frame, rules, sensor_type):
+    """
+    Bad value mask of every rule in one pass over frame, a (len(rules), len(frame)) boolean array.
+
+    sensor_type is the type of the whole frame or an array with the type of each row (for a frame stacking
+    several sensors). A rule whose column is missing from frame flags nothing.
+    """
+    values = resolve_columns(frame, rules)
+    sensor_type = np.asarray(sensor_type, dtype=object)
+    masks = np.zeros((len(rules), len(frame)), dtype=bool)
+    for i, rule in enumerate(rules):
+        column = values.get(rule.columns[0])
+        if column is None:
+            continue
+        applies = np.isin(sensor_type, rule.sensor_type)
+        if not applies.any():
+            continue
+        mask = np.zeros(len(frame), dtype=bool)
+        for name, x in rule.predicate.items():
+            mask |= PREDICATES[name](column, x)
+        masks[i] = mask & applies
+    return masks
+
+
+def check_values(frame, rules, sensor_type):
+    """
+    Evaluate the rules on the frame of one sensor.
+
+    Returns (counts, timestamps), the number of bad values of each rule and their datetimes formatted as
+    '%Y-%m-%d %H:%M:%S', both in the order of rules.
+    """
+    masks = rule_masks(frame, rules, sensor_type)
+    counts = masks.sum(axis=1)
+    if counts.any():
+        formatted = frame['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+        timestamps = [formatted[mask].tolist() for mask in masks]
+    else:
+        timestamps = [[] for _ in rules]
+    return counts, timestamps
+
+
+def status_text(rules, counts, detail=False):
+    """Messages of the rules with bad values joined with '; ', '' when every value is in range"""
+    messages = [
+        (rule.detail_message if detail else rule.message).format(count=int(count))
+        for rule, count in zip(rules, counts) if count > 0
+    ]
+    return '; '.join(messages)
@@ -0,0 +1,287 @@
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from rules import load_rules
+from sync import resolve
+from timing import event
+
+
+# Column names used by get_reports
+COLUMN_RENAMES = {'SiteName': 'datetime', 'CBC': 'Batt', 'DEPTH': 'depth', 'Depth': 'depth', 'TURBwo': 'turbwo'}
+DATETIME_FORMAT = '%d/%m/%y %I:%M:%S %p'
+
+# CSV columns every report reads (datetime, battery and the depth plots), the rules add their value columns per type
+BASE_COLUMNS = ['SiteName', 'CBC', 'DEPTH', 'Depth']
+
+# Only plotted, float32 is enough. The rule columns stay float64 so values on a limit compare the same
+FLOAT32_COLUMNS = ['DEPTH', 'Depth', 'depth']
+
+# Character positions in a DATETIME_FORMAT string, e.g. '05/06/24 01:02:03 PM'
+_DATETIME_WIDTH = 20
+_DIGITS = {'day': [0, 1], 'month': [3, 4], 'year': [6, 7], 'hour': [9, 10], 'minute': [12, 13], 'second': [15, 16]}
+_SEPARATORS = {2: '/', 5: '/', 8: ' ', 11: ':', 14: ':', 17: ' ', 19: 'M'}
+
+
+def parse_datetimes(values, errors='raise'):
+    """
+    Same values as pd.to_datetime(values, format=DATETIME_FORMAT, errors=errors) (as datetime64[ns]), several times faster.
+
+    The logger writes fixed width timestamps, so the fields are sliced out of the characters as integer arrays and
+    combined into datetime64 directly. Values that don't have the exact layout (or are not valid dates) go through
+    pd.to_datetime.
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    text = np.asarray(values, dtype=object)
+    n = len(text)
+    # One UTF-32 code point per character, one spare column so longer strings can be told apart
+    chars = text.astype(f'U{_DATETIME_WIDTH + 1}').view(np.uint32).reshape(n, _DATETIME_WIDTH + 1)
+
+    valid = (chars[:, _DATETIME_WIDTH] == 0) & np.isin(chars[:, 18], [ord('A'), ord('P')])
+    for position, separator in _SEPARATORS.items():
+        valid &= chars[:, position] == ord(separator)
+    digits = chars.astype(np.int64) - ord('0')
+    fields = {}
+    for name, (tens, ones) in _DIGITS.items():
+        valid &= (digits[:, tens] >= 0) & (digits[:, tens] <= 9) & (digits[:, ones] >= 0) & (digits[:, ones] <= 9)
+        fields[name] = digits[:, tens] * 10 + digits[:, ones]
+
+    # %y: 69-99 are 1900s, 00-68 are 2000s. %I %p: 12 AM is 0h, 12 PM is 12h
+    year = fields['year'] + np.where(fields['year'] < 69, 2000, 1900)
+    hour = fields['hour'] % 12 + np.where(chars[:, 18] == ord('P'), 12, 0)
+    valid &= (fields['month'] >= 1) & (fields['month'] <= 12) & (fields['hour'] >= 1) & (fields['hour'] <= 12)
+    valid &= (fields['minute'] <= 59) & (fields['second'] <= 59) & (fields['day'] >= 1)
+
+    months = np.where(valid, (year - 1970) * 12 + fields['month'] - 1, 0).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + np.where(valid, fields['day'] - 1, 0)
+    valid &= days.astype('datetime64[M]') == months  # 31/04 rolls over into May
+    seconds = hour * 3600 + fields['minute'] * 60 + fields['second']
+    result = (days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')).astype('datetime64[ns]')
+
+    if not valid.all():
+        result[~valid] = pd.to_datetime(pd.Series(text[~valid], dtype=object), format=DATETIME_FORMAT, errors=errors).to_numpy(dtype='datetime64[ns]')
+    return pd.Series(result, index=index) if index is not None else pd.DatetimeIndex(result)
+
+
+def sensor_key(filename, odd_filenames=None):
+    """(sensor_location, sensor_cover, sensor_type) of a sensor CSV, same as get_reports extracts it"""
+    filename = (odd_filenames or {}).get(filename, filename)
+    match = re.search(r'(\w+)_(\w+)_(\w+)\.csv', filename)
+    if match is None:
+        return None
+    return tuple(x.upper() for x in match.groups())
+
+
+def sensor_columns(sensor_type, rules=None):
+    """CSV columns the reports read from a sensor of sensor_type, BASE_COLUMNS and every alias of its rules"""
+    rules = rules if rules is not None else load_rules()
+    columns = list(BASE_COLUMNS)
+    for rule in rules:
+        if sensor_type in rule.sensor_type:
+            columns.extend(rule.columns)
+    return list(dict.fromkeys(columns))
+
+
+def compact_dtypes(sensor_data):
+    """FLOAT32_COLUMNS as float32, integer columns downcast to the smallest integer type, other text as categories"""
+    for column in sensor_data.columns:
+        values = sensor_data[column]
+        if column in FLOAT32_COLUMNS and pd.api.types.is_float_dtype(values):
+            sensor_data[column] = values.astype('float32')
+        elif pd.api.types.is_integer_dtype(values):
+            sensor_data[column] = pd.to_numeric(values, downcast='integer')
+        elif column not in ('SiteName', 'datetime') and values.dtype == object:
+            sensor_data[column] = values.astype('category')
+    return sensor_data
+
+
+def record_savings(sensor_data, name, n_columns):
+    """
+    Keep the bytes saved by the column selection and compact_dtypes in sensor_data.attrs['saved_bytes'].
+
+    The saving is estimated against reading all n_columns of the file as 8 byte values, what pd.read_csv does
+    for numeric columns.
+    """
+    used = int(sensor_data.memory_usage(deep=True).sum())
+    saved = max(0, len(sensor_data) * n_columns * 8 - used)
+    sensor_data.attrs['saved_bytes'] = saved
+    print(f"Loaded {name}: {used / 2**20:.2f} MB, {saved / 2**20:.2f} MB saved by the column selection and dtypes")
+    return sensor_data
+
+
+def load_sensor_csv(source, columns=None, engine='c'):
+    """
+    Parse a sensor CSV, renamed (COLUMN_RENAMES) and sorted by datetime.
+
+    When columns is given only those of them present in the file are read and their dtypes are compacted. The
+    pyarrow engine needs the header up front, so it is only used for local copies, a url is read with the C parser.
+    """
+    if columns is None:
+        sensor_data = pd.read_csv(source)
+    elif engine == 'pyarrow' and os.path.exists(source):
+        with open(source) as f:
+            header = f.readline().strip().split(',')
+        sensor_data = pd.read_csv(source, engine='pyarrow', usecols=[x for x in header if x in columns])
+    else:
+        header = {}
+
+        def usecol(name):
+            header[name] = None
+            return name in columns
+
+        sensor_data = pd.read_csv(source, usecols=usecol)
+    sensor_data = sensor_data.rename(columns=COLUMN_RENAMES)
+    sensor_data['datetime'] = parse_datetimes(sensor_data['datetime'])
+    sensor_data = sensor_data.sort_values('datetime').reset_index(drop=True)
+    if columns is not None:
+        sensor_data = record_savings(compact_dtypes(sensor_data), os.path.basename(str(source)), len(header))
+    return sensor_data
+
+
+def load_sensor(data_location, rules=None, engine='c', odd_filenames=None):
+    """
+    Loader for SensorStore, only the columns the reports read for the sensor's type (see sensor_columns).
+
+    The local copy from the last sync is read if there is one, otherwise straight from the url.
+    """
+    key = sensor_key(unquote(urlparse(data_location).path.rsplit('/', 1)[-1]), odd_filenames)
+    columns = sensor_columns(key[2] if key is not None else None, rules)
+    return load_sensor_csv(resolve(data_location), columns=columns, engine=engine)
+
+
+class SensorStore:
+    """
+    Parsed sensor data for one run of get_reports.
+
+    Every sensor CSV is downloaded, parsed, renamed and sorted once and then shared by the summary and the
+    detailed report. Frames are kept in memory up to max_memory_mb, the least recently used ones are spilled
+    to Feather/Parquet files in a temporary folder and read back on the next request. get can be called from
+    several threads, a sensor is loaded once and the other threads asking for it wait for that load.
+    """
+
+    def __init__(self, max_memory_mb=512, spill_format='feather', loader=load_sensor):
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.spill_format = spill_format
+        self.loader = loader
+        self.memory_used = 0
+        self._frames = OrderedDict()  # data_location -> (frame, bytes)
+        self._spilled = {}  # data_location -> path of the spilled frame
+        self._errors = {}  # data_location -> exception raised when it was loaded
+        self._spill_dir = None
+        self._spill_ids = itertools.count()  # Never reused, invalidate() frees a name while others are still spilled
+        self._lock = threading.RLock()
+        self._loading = {}  # data_location -> lock held while it is loaded
+
+    def get(self, data_location):
+        with self._lock:
+            loading = self._loading.setdefault(data_location, threading.Lock())
+        with loading:
+            sensor_data = self._get(data_location)
+        # Callers add/replace columns on their copy, the stored frame stays untouched
+        return sensor_data.copy(deep=False)
+
+    def _get(self, data_location):
+        with self._lock:
+            if data_location in self._errors:
+                raise self._errors[data_location]
+            if data_location in self._frames:
+                self._frames.move_to_end(data_location)
+                return self._frames[data_location][0]
+            spill_path = self._spilled.get(data_location)
+
+        if spill_path is not None:
+            sensor_data = self._read_spill(spill_path)
+        else:
+            start = time.perf_counter()
+            try:
+                sensor_data = self.loader(data_location)
+                event('sensor', data_location, time.perf_counter() - start, rows=len(sensor_data), saved_bytes=sensor_data.attrs.get('saved_bytes', 0))
+            except Exception as e:
+                # Remember the failure so the second report stage does not download it again
+                with self._lock:
+                    self._errors[data_location] = e
+                raise
+        with self._lock:
+            self._add(data_location, sensor_data)
+        return sensor_data
+
+    def preload(self, data_locations, max_workers=1):
+        """
+        Load sensors in max_workers threads ahead of the report loops, the fetch and the parsing of one sensor overlap
+        with the others. Returns {data_location: exception} of the sensors that could not be loaded.
+        """
+        def load(data_location):
+            try:
+                self.get(data_location)
+            except Exception as e:
+                return e
+
+        data_locations = list(dict.fromkeys(data_locations))
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            errors = dict(zip(data_locations, executor.map(load, data_locations)))
+        return {x: e for x, e in errors.items() if e is not None}
+
+    def invalidate(self, data_location):
+        """Forget a sensor whose CSV changed, the next get loads it again"""
+        with self._lock:
+            self._errors.pop(data_location, None)
+            if data_location in self._frames:
+                self.memory_used -= self._frames.pop(data_location)[1]
+            path = self._spilled.pop(data_location, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def _add(self, data_location, sensor_data):
+        size = int(sensor_data.memory_usage(deep=True).sum())
+        self._frames[data_location] = (sensor_data, size)
+        self.memory_used += size
+        # Always keep the frame that was just requested, even when it is larger than the budget
+        while self.memory_used > self.max_memory and len(self._frames) > 1:
+            self._evict()
+
+    def _evict(self):
+        data_location, (sensor_data, size) = self._frames.popitem(last=False)
+        self.memory_used -= size
+        if data_location not in self._spilled:
+            self._spilled[data_location] = self._write_spill(sensor_data)
+
+    def _write_spill(self, sensor_data):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix='sensor_store_')
+        path = os.path.join(self._spill_dir.name, f"{next(self._spill_ids)}.{self.spill_format}")
+        try:
+            if self.spill_format == 'parquet':
+                sensor_data.to_parquet(path)
+            else:
+                sensor_data.to_feather(path)
+        except Exception as e:
+            # Duplicated or mixed type columns can't be written as arrow, keep them as a pickle instead
+            print(f"Could not spill as {self.spill_format} ({e}), using pickle")
+            path = f"{path}.pkl"
+            sensor_data.to_pickle(path)
+        return path
+
+    def _read_spill(self, path):
+        if path.endswith('.pkl'):
+            return pd.read_pickle(path)
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        return pd.read_feather(path)
+
+    def close(self):
+        with self._lock:
+            self._frames.clear()
+            self._spilled.clear()
+            self.memory_used = 0
+            if self._spill_dir is not None:
+                self._spill_dir.cleanup()
+                self._spill_dir = None
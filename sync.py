@@ -0,0 +1,125 @@
+import json
+import os
+import requests
+from urllib.parse import unquote, urlparse
+
+
+MANIFEST_PATH = 'data/manifest.json'
+RAW_DIR = 'data/raw'
+
+# Bytes downloaded again in front of the cached end, to check the upstream file was only appended to
+OVERLAP_BYTES = 1024
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+    manifest.setdefault('files', {})
+    manifest.setdefault('sites', {})
+    return manifest
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    # Write then rename so a crash never leaves half a manifest behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def local_path(data_location, raw_dir=RAW_DIR):
+    return os.path.join(raw_dir, unquote(urlparse(data_location).path.rsplit('/', 1)[-1]))
+
+
+def resolve(data_location, raw_dir=RAW_DIR):
+    """Local copy of a sensor CSV if it has been synced, otherwise the url itself"""
+    path = local_path(data_location, raw_dir)
+    return path if os.path.exists(path) else data_location
+
+
+def sync_file(browser, url, last_modified, entry=None, raw_dir=RAW_DIR):
+    """
+    Bring the local copy of url up to date and return (manifest entry, status).
+
+    Nothing is requested when the listing's last modified value matches the manifest. Otherwise only the bytes
+    past the cached end are requested (Range + If-Modified-Since). If the server ignores the range, or the
+    overlapping bytes show the file was rewritten rather than appended to, the whole file is downloaded again.
+    """
+    path = local_path(url, raw_dir)
+    entry = entry or {}
+    cached_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    if cached_size and entry.get('last_modified') == last_modified:
+        return entry, 'unchanged'
+
+    status = 'downloaded'
+    response = None
+    if cached_size and entry:
+        start = max(0, cached_size - OVERLAP_BYTES)
+        headers = {'Range': f'bytes={start}-'}
+        if entry.get('http_last_modified'):
+            headers['If-Modified-Since'] = entry['http_last_modified']
+        try:
+            response = browser.get(url, headers=headers)
+        except requests.HTTPError as e:
+            # 416, the file is now shorter than our copy
+            if e.response is None or e.response.status_code != 416:
+                raise
+
+        if response is not None and response.status_code == 304:
+            status = 'not modified'
+        elif response is not None and response.status_code == 206 and _append(path, response.content, start, cached_size):
+            status = 'appended'
+        elif response is not None and response.status_code == 200:
+            _write(path, response.content)
+        else:
+            response = None
+
+    if response is None:
+        response = browser.get(url)
+        _write(path, response.content)
+
+    return {
+        **entry,
+        'url': url,
+        'last_modified': last_modified,
+        'http_last_modified': response.headers.get('Last-Modified', entry.get('http_last_modified')),
+        'bytes': os.path.getsize(path)
+    }, status
+
+
+def _append(path, content, start, cached_size):
+    overlap = cached_size - start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        cached_tail = f.read(overlap)
+    if content[:overlap] != cached_tail:
+        return False
+    with open(path, 'ab') as f:
+        f.write(content[overlap:])
+    return True
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def listing_modified(rows):
+    """{entry name: last modified text} for the rows of a directory listing"""
+    modified = {}
+    for row in rows:
+        td_texts = [text for text in row.cells if text.strip() != '']
+        if row.links and len(td_texts) >= 3:
+            modified[row.links[0][1]] = td_texts[1]
+    return modified
+
+
+def site_unchanged(entry, modified, name):
+    return name in modified and entry.get('modified', {}).get(name) == modified[name]
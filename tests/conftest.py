@@ -0,0 +1,62 @@
+import contextlib
+import functools
+import os
+import socket
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(directory):
+    """Serves directory over HTTP on a free port, yields the base url"""
+    handler = functools.partial(QuietHandler, directory=str(directory))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def listing_server():
+    """Serves the recorded Apache listings of tests/listings, yields the base url"""
+    with serve(os.path.join(TESTS_DIR, 'listings')) as base_url:
+        yield base_url
+
+
+@pytest.fixture
+def smtp_server():
+    """Local SMTP stand-in (aiosmtpd), yields (server address, list of the received envelopes)"""
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    received = []
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            received.append(envelope)
+            return '250 OK'
+
+    # The controller checks it is up by connecting to its port, so it can't be given port 0
+    port = free_port()
+    controller = controller_module.Controller(Handler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    yield f"127.0.0.1:{port}", received
+    controller.stop()
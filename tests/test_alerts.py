@@ -0,0 +1,90 @@
+"""Alert transitions, mailed to a local SMTP stand-in"""
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from conftest import free_port
+from alerts import alert_text, sensor_states, transitions
+from metrics_db import connect
+from sensor_store import SensorStore
+from utils import send_mail
+
+NOW = datetime(2024, 6, 12, 12, 0)
+
+
+def states(battery):
+    return pd.DataFrame({
+        'sensor_location': ['SITE0'],
+        'sensor_cover': ['GRASS'],
+        'sensor_type': ['DT'],
+        'check_name': ['battery'],
+        'state': [battery]
+    })
+
+
+def mailer(server):
+    def send(alerted):
+        send_mail('from@example.com', ['to@example.com'], 'IDDE Sensor Alert', alert_text(alerted), server=server)
+    return send
+
+
+@pytest.fixture
+def conn(tmp_path):
+    with closing(connect(str(tmp_path / 'sensor_metrics.db'))) as conn:
+        yield conn
+
+
+def stored(conn):
+    state = conn.execute('SELECT state FROM sensor_alert_state').fetchall()
+    return [x for (x,) in state], conn.execute('SELECT COUNT(*) FROM sensor_alert_log').fetchone()[0]
+
+
+def test_transition_is_mailed_and_logged(conn, smtp_server):
+    server, received = smtp_server
+    assert transitions(conn, states('OK'), NOW, send=mailer(server)).empty
+    alerted = transitions(conn, states('LOW'), NOW, send=mailer(server))
+    assert alerted[['old_state', 'state']].values.tolist() == [['OK', 'LOW']]
+    assert len(received) == 1
+    assert b'SITE0 GRASS DT: Battery OK -> LOW' in received[0].content
+    assert stored(conn) == (['LOW'], 1)
+
+
+def test_failed_send_stores_nothing(conn, smtp_server):
+    server, received = smtp_server
+    transitions(conn, states('OK'), NOW, send=mailer(server))
+    with pytest.raises(OSError):
+        transitions(conn, states('LOW'), NOW, send=mailer(f"127.0.0.1:{free_port()}"))
+    # Neither the state nor the rate limit moved, the next evaluation alerts it
+    assert stored(conn) == (['OK'], 0)
+    alerted = transitions(conn, states('LOW'), NOW, send=mailer(server))
+    assert len(alerted) == 1 and len(received) == 1
+    assert stored(conn) == (['LOW'], 1)
+
+
+def test_rate_limit(conn, smtp_server):
+    server, received = smtp_server
+    transitions(conn, states('OK'), NOW, send=mailer(server))
+    for battery in ['LOW', 'OK', 'LOW']:
+        transitions(conn, states(battery), NOW, max_alerts=2, send=mailer(server))
+    # The third change is stored but not alerted
+    assert len(received) == 2
+    assert stored(conn) == (['LOW'], 2)
+
+
+def test_sensor_states():
+    frames = {
+        'http://host/data/site0_grass_dt.csv': pd.DataFrame({'datetime': pd.to_datetime(['2024-06-12 10:00', '2024-06-12 11:00']), 'Batt': [3600, 3400]}),
+        'http://host/data/site1_grass_dt.csv': pd.DataFrame({'datetime': pd.to_datetime(['2024-06-10 10:00']), 'Batt': [-88]})
+    }
+    metadata_logger = pd.DataFrame({'data_location': list(frames), 'filename': [x.rsplit('/', 1)[-1] for x in frames]})
+    store = SensorStore(loader=frames.get)
+    states = sensor_states(store, metadata_logger, 2500, 3500, now=NOW)
+    store.close()
+    assert states.sort_values(['check_name', 'sensor_location'])[['sensor_location', 'check_name', 'state']].values.tolist() == [
+        ['SITE0', 'battery', 'LOW'],
+        ['SITE1', 'battery', 'UNREADABLE'],
+        ['SITE0', 'updated', 'YES'],
+        ['SITE1', 'updated', 'NO']
+    ]
@@ -0,0 +1,36 @@
+"""Parquet archive of the synced CSVs"""
+import pandas as pd
+
+import archive
+
+# Two days of readings, the logger's day/month/year format
+CSV = (
+    'SiteName,CBC,DEPTH\n'
+    '01/06/24 11:00:00 PM,3600,1.5\n'
+    '02/06/24 01:00:00 AM,3590,1.6\n'
+    '02/06/24 01:06:00 AM,3580,1.7\n'
+)
+KEY = ('SITE0', 'GRASS', 'DT')
+
+
+def archived(tmp_path):
+    path = tmp_path / 'site0_grass_dt.csv'
+    path.write_text(CSV)
+    archive_dir = str(tmp_path / 'archive')
+    assert archive.ingest(str(path), {}, archive_dir=archive_dir) == 3
+    return archive_dir
+
+
+def test_read_since(tmp_path):
+    archive_dir = archived(tmp_path)
+    sensor_data = archive.read_sensor(KEY, since='2024-06-02 01:05', archive_dir=archive_dir)
+    assert sensor_data['datetime'].tolist() == [pd.Timestamp('2024-06-02 01:06')]
+    assert archive.read_sensor(('SITE1', 'GRASS', 'DT'), archive_dir=archive_dir) is None
+
+
+def test_stale_sensor_reads_its_newest_partition(tmp_path):
+    archive_dir = archived(tmp_path)
+    # Nothing archived since, the last day it reported is read rather than the CSV
+    sensor_data = archive.load_sensor('http://host/data/site0_grass_dt.csv', since='2024-06-12', archive_dir=archive_dir)
+    assert sensor_data['datetime'].tolist() == [pd.Timestamp('2024-06-02 01:00'), pd.Timestamp('2024-06-02 01:06')]
+    assert sensor_data['Batt'].tolist() == [3590, 3580]
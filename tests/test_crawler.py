@@ -0,0 +1,75 @@
+"""
+The HTTP crawler against recorded Apache listings (tests/listings), served from a local server.
+
+tests/listings/expected holds metadata-logger.csv and metadata-images.csv as the Selenium scraper wrote them for
+these listings (with VALID_PATTERNS below), the server's address replaced by BASE_URL.
+"""
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import TESTS_DIR
+from crawler import HttpBrowser, parse_listing
+from get_raw_data import scrape_images_metadata, scrape_logger_metadata
+from image_store import parse_size_kb
+
+VALID_PATTERNS = ['site0_grass', 'site1_grass']
+EXPECTED_DIR = os.path.join(TESTS_DIR, 'listings', 'expected')
+
+
+def expected_csv(name, base_url):
+    expected = pd.read_csv(os.path.join(EXPECTED_DIR, name), dtype=str, keep_default_na=False)
+    return expected.replace('BASE_URL', base_url, regex=True)
+
+
+@pytest.fixture
+def browser(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    browser = HttpBrowser(retries=0)
+    yield browser
+    browser.close()
+
+
+def test_parse_listing_rows():
+    with open(os.path.join(TESTS_DIR, 'listings', 'data', 'index.html')) as f:
+        rows = parse_listing(f.read(), 'http://host/data/').rows
+    # Header and separator rows have <th> cells only, the parent row and every entry have 5 <td> cells
+    assert [len(x.cells) for x in rows[:3]] == [0, 0, 5]
+    assert rows[3].links == [('http://host/data/site0_grass_dt.csv', 'site0_grass_dt.csv')]
+    assert rows[3].cells[1:4] == ['site0_grass_dt.csv', '2024-06-12 10:15', '1.2M']
+    # &nbsp; cells are empty, as td.text.strip() is in Selenium
+    assert rows[2].cells[2] == ''
+
+
+def test_status_text_and_html(listing_server, browser):
+    # A status file served as text and one served as an HTML page with a <pre> block
+    text = browser.text(f"{listing_server}/images/site0_GRASS_CAM/status")
+    html = browser.text(f"{listing_server}/images/site1_GRASS_CAM/status")
+    assert text.strip().splitlines()[-1] == '2024-06-12 02:00:00,site0,12.6,3598,OK'
+    assert html.strip().splitlines()[-1] == '2024-06-12 00:00:00,site1,11.8,-88,OK'
+
+
+def test_logger_metadata_matches_selenium(listing_server, browser):
+    scrape_logger_metadata(browser, f"{listing_server}/data/", VALID_PATTERNS)
+    written = pd.read_csv('data/metadata-logger.csv', dtype=str, keep_default_na=False)
+    pd.testing.assert_frame_equal(written, expected_csv('metadata-logger.csv', listing_server))
+
+
+def test_images_metadata_matches_selenium(listing_server, browser):
+    scrape_images_metadata(browser, f"{listing_server}/images/", VALID_PATTERNS, max_workers=4)
+    expected = expected_csv('metadata-images.csv', listing_server)
+
+    # The site columns are in metadata-images.csv, one row per site
+    sites = ['data_location', 'last_modified', 'latest_battery_level']
+    written = pd.read_csv('data/metadata-images.csv', dtype=str, keep_default_na=False)
+    pd.testing.assert_frame_equal(written[sites], expected[sites].drop_duplicates().reset_index(drop=True))
+
+    # The images themselves are in the image store
+    with sqlite3.connect('sensor_metrics.db') as conn:
+        stored = pd.read_sql_query('SELECT site, img_filename, size_kb FROM image_metadata ORDER BY rowid', conn)
+    assert stored['site'].tolist() == expected['data_location'].tolist()
+    assert stored['img_filename'].tolist() == expected['img_filename'].tolist()
+    assert stored['size_kb'].tolist() == parse_size_kb(expected['size']).tolist()
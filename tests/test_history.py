@@ -0,0 +1,32 @@
+"""Battery trends and the projected LOW/CRITICAL dates"""
+import pandas as pd
+
+from history import battery_trends, crossing_date
+
+
+def history(levels, sensor_location='SITE0'):
+    return pd.DataFrame({
+        'sensor_location': sensor_location,
+        'sensor_cover': 'GRASS',
+        'sensor_type': 'DT',
+        'last_timestamp_recorded': [f"2024-06-{day:02d} 12:00:00" for day in range(1, len(levels) + 1)],
+        'current_battery_level': levels,
+        'report_date': [f"2024-06-{day:02d}" for day in range(1, len(levels) + 1)]
+    })
+
+
+def test_draining_sensor_crossing_dates():
+    trends = battery_trends(history([4000, 3900, 3800, -88, 3600]))
+    assert trends['slope_per_day'].tolist() == [-100]
+    assert trends['latest'].round(6).tolist() == [3600]
+    assert crossing_date(trends, 3500).tolist() == [pd.Timestamp('2024-06-06 12:00:00')]
+    # Beyond the horizon
+    assert crossing_date(trends, 3500, horizon_days=0.5).isna().all()
+
+
+def test_no_sensor_with_enough_readings():
+    # Nothing to fit, the forecast is empty but still typed
+    for levels in ([], [-88, -88], [3600, 3500]):
+        trends = battery_trends(history(levels))
+        assert trends.empty
+        assert pd.api.types.is_datetime64_any_dtype(crossing_date(trends, 3500))
@@ -0,0 +1,62 @@
+"""Image store counts kept in line with the listings"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from image_store import quality_stats, update_images
+
+NOW = pd.Timestamp('2024-06-12 12:00')
+SITE = 'http://host/images/site0_GRASS_CAM'
+
+
+def listing(images):
+    """images is {filename: (size as listed, modified)}"""
+    return pd.DataFrame({
+        'img_filename': list(images),
+        'size': [x[0] for x in images.values()],
+        'modified': pd.to_datetime([x[1] for x in images.values()])
+    })
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / 'sensor_metrics.db')
+
+
+def counts(db, table):
+    with sqlite3.connect(db) as conn:
+        return conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall()
+
+
+def test_counts_follow_the_listing(db):
+    images = {
+        'a.jpg': ('80K', '2024-06-12 10:05'),
+        'b.jpg': ('80K', '2024-06-12 11:10'),
+        'c.jpg': ('40K', '2024-06-01 09:00')
+    }
+    assert update_images(SITE, listing(images), NOW, db) == 3
+    assert update_images(SITE, listing(images), NOW, db) == 0
+    assert counts(db, 'image_size_counts') == [(SITE, 40.0, 1), (SITE, 80.0, 2)]
+
+    # b and c were removed from the camera's folder, d is new
+    del images['b.jpg'], images['c.jpg']
+    images['d.jpg'] = ('20K', '2024-06-12 11:30')
+    assert update_images(SITE, listing(images), NOW, db) == 1
+    assert counts(db, 'image_size_counts') == [(SITE, 20.0, 1), (SITE, 80.0, 1)]
+    assert counts(db, 'image_hourly_size_counts') == [
+        (SITE, '2024-06-12 10:00:00', 80.0, 1),
+        (SITE, '2024-06-12 11:00:00', 20.0, 1)
+    ]
+    stats = quality_stats(0.75, ['24h'], NOW, db).loc[SITE]
+    assert stats['percent_hq_images'] == 50 and stats['percent_hq_images_24h'] == 50
+
+
+def test_emptied_listing(db):
+    update_images(SITE, listing({'a.jpg': ('80K', '2024-06-12 10:05')}), NOW, db)
+    update_images('other', listing({'a.jpg': ('60K', '2024-06-12 10:05')}), NOW, db)
+    assert update_images(SITE, listing({}), NOW, db) == 0
+    # Only the emptied site is cleared
+    assert counts(db, 'image_metadata') == [('other', 'a.jpg', 60.0, '2024-06-12 10:05:00', '2024-06-12 12:00:00')]
+    assert counts(db, 'image_size_counts') == [('other', 60.0, 1)]
+    assert counts(db, 'image_hourly_size_counts') == [('other', '2024-06-12 10:00:00', 60.0, 1)]
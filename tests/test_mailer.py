@@ -0,0 +1,100 @@
+"""Mailer round trips through a local SMTP stand-in"""
+import email
+import io
+import os
+import socket
+import zipfile
+from email import policy
+
+import pytest
+
+from mailer import DataStream, Mailer
+
+DOTTED = b'.hello\r\n..x\n.\nend' * 1000
+
+
+@pytest.fixture
+def mailer(smtp_server):
+    mailer = Mailer(smtp_server[0])
+    yield mailer
+    mailer.close()
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {
+        'dotted.txt': DOTTED,
+        'random.bin': os.urandom(2**20 + 17),
+        'report.pdf': b'%PDF compressible ' * 100000
+    }
+    for name, data in paths.items():
+        (tmp_path / name).write_bytes(data)
+    return {name: str(tmp_path / name) for name in paths}
+
+
+def parse(envelope):
+    return email.message_from_bytes(envelope.content, policy=policy.default)
+
+
+def attachments(msg):
+    found = {}
+    for part in msg.iter_attachments():
+        data = part.get_payload(decode=True)
+        name = part.get_filename()
+        if name.endswith('.zip'):
+            name = name[:-4]
+            data = zipfile.ZipFile(io.BytesIO(data)).read(name)
+        found[name] = data
+    return found
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = b''
+
+    def sendall(self, data):
+        self.sent += bytes(data)
+
+
+def test_dot_stuffing():
+    sock = Recorder()
+    stream = DataStream(sock)
+    for data in [b'.a\r\nb\r\n', b'.c\r\n', b'd\r\n.', b'e']:
+        stream.write(data)
+    stream.end()
+    assert sock.sent == b'..a\r\nb\r\n..c\r\nd\r\n..e\r\n.\r\n'
+
+
+def test_round_trip(smtp_server, mailer, files):
+    _, received = smtp_server
+    mailer.send('from@example.com', ['a@example.com', 'b@example.com'], 'Rapport é', 'Texte é\n.dot line', [files['dotted.txt'], files['random.bin']])
+    envelope, = received
+    assert envelope.rcpt_tos == ['a@example.com', 'b@example.com']
+    msg = parse(envelope)
+    assert msg['Subject'] == 'Rapport é'
+    assert msg.get_body().get_content() == 'Texte é\n.dot line'
+    assert attachments(msg) == {'dotted.txt': DOTTED, 'random.bin': open(files['random.bin'], 'rb').read()}
+
+
+def test_attachment_cap(smtp_server, mailer, files):
+    _, received = smtp_server
+    paths = [files['dotted.txt'], files['report.pdf'], files['random.bin']]
+    mailer.send('from@example.com', ['a@example.com'], 'Reports', 'See attachments', paths, max_attachment_mb=1, link_url='https://example.com/reports/')
+    msg = parse(received[0])
+    # The PDF fits once zipped, the random file doesn't compress and is linked instead
+    assert [x.get_filename() for x in msg.iter_attachments()] == ['dotted.txt', 'report.pdf.zip']
+    assert attachments(msg)['report.pdf'] == open(files['report.pdf'], 'rb').read()
+    assert 'random.bin (1.0 MB): https://example.com/reports/random.bin' in msg.get_body().get_content()
+
+
+def test_one_session_and_reconnect(smtp_server, mailer):
+    _, received = smtp_server
+    for i in range(3):
+        mailer.send('from@example.com', ['a@example.com'], f"Message {i}", 'x')
+    assert mailer.sessions == 1
+
+    # The server drops the session, the next send opens a new one
+    mailer._smtp.sock.shutdown(socket.SHUT_RDWR)
+    mailer.send('from@example.com', ['a@example.com'], 'After drop', 'x')
+    assert mailer.sessions == 2
+    assert [parse(x)['Subject'] for x in received] == ['Message 0', 'Message 1', 'Message 2', 'After drop']
@@ -0,0 +1,43 @@
+"""SensorStore spilling and invalidation, with an in-memory loader"""
+import pandas as pd
+import pytest
+
+from sensor_store import SensorStore
+
+
+def frame(name):
+    # About 80 kB each
+    return pd.DataFrame({'datetime': pd.date_range('2024-06-01', periods=10000, freq='6min'), 'value': float(ord(name))})
+
+
+@pytest.fixture
+def store():
+    loads = []
+
+    def loader(data_location):
+        loads.append(data_location)
+        return frame(data_location)
+
+    store = SensorStore(max_memory_mb=0.1, loader=loader)
+    store.loads = loads
+    yield store
+    store.close()
+
+
+def test_spilled_frames_are_read_back(store):
+    for name in 'abc':
+        store.get(name)
+    assert set(store._spilled) == {'a', 'b'}
+    pd.testing.assert_frame_equal(store.get('a'), frame('a'))
+    assert store.loads == ['a', 'b', 'c']
+
+
+def test_invalidate_does_not_overwrite_other_spills(store):
+    store.get('a')
+    store.get('b')
+    store.get('c')  # a and b spilled
+    store.invalidate('a')
+    store.get('d')  # c spilled, under a name that was free before a was invalidated
+    assert len(set(store._spilled.values())) == len(store._spilled)
+    for name in 'bcd':
+        pd.testing.assert_frame_equal(store.get(name), frame(name))
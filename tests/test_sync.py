@@ -0,0 +1,76 @@
+"""Syncing the sensor CSVs from a local server, with a file that can't be fetched"""
+import os
+
+import pandas as pd
+import pytest
+
+from checkpoint import Checkpoint
+from conftest import serve
+from crawler import HttpBrowser
+from get_raw_data import sync_logger_files
+from sync import local_path
+
+CSV = 'SiteName,CBC,DEPTH\n2024/06/12 00:00:00,3600,1.5\n'
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Serves tmp_path/site with site0_grass_dt.csv only, runs in tmp_path/run"""
+    os.makedirs(tmp_path / 'site')
+    (tmp_path / 'site' / 'site0_grass_dt.csv').write_text(CSV)
+    os.makedirs(tmp_path / 'run')
+    monkeypatch.chdir(tmp_path / 'run')
+    with serve(tmp_path / 'site') as base_url:
+        yield base_url
+
+
+def listed(base_url):
+    filenames = ['site0_grass_dt.csv', 'site1_grass_dt.csv']
+    return pd.DataFrame({
+        'filename': filenames,
+        'data_location': [f"{base_url}/{x}" for x in filenames],
+        'last_modified': pd.Timestamp('2024-06-12 10:00')
+    })
+
+
+def test_missing_file_does_not_stop_the_sync(server):
+    http = HttpBrowser(retries=0)
+    manifest = {'files': {}, 'sites': {}}
+    statuses = sync_logger_files(http, listed(server), manifest)
+    http.close()
+    assert statuses['site0_grass_dt.csv'] == 'downloaded'
+    assert statuses['site1_grass_dt.csv'].startswith('error: 404')
+    assert open(local_path(f"{server}/site0_grass_dt.csv")).read() == CSV
+    assert manifest['files']['site1_grass_dt.csv'] == {'url': f"{server}/site1_grass_dt.csv"}
+
+
+def test_failed_file_keeps_its_last_copy(server):
+    # site1 was synced by an earlier run, it has since gone from the server
+    url = f"{server}/site1_grass_dt.csv"
+    os.makedirs('data/raw')
+    with open(local_path(url), 'w') as f:
+        f.write(CSV)
+    previous = {'url': url, 'last_modified': '2024-06-11 10:00:00', 'bytes': len(CSV)}
+    manifest = {'files': {'site1_grass_dt.csv': dict(previous)}, 'sites': {}}
+
+    http = HttpBrowser(retries=0)
+    statuses = sync_logger_files(http, listed(server), manifest)
+    http.close()
+    assert statuses['site1_grass_dt.csv'].startswith('error: 404')
+    assert manifest['files']['site1_grass_dt.csv'] == previous
+    assert open(local_path(url)).read() == CSV
+
+
+def test_resumed_run_keeps_the_error(server, tmp_path):
+    checkpoint = Checkpoint('2024-06-12', directory=str(tmp_path / 'checkpoints'))
+    http = HttpBrowser(retries=0)
+    sync_logger_files(http, listed(server), {'files': {}, 'sites': {}}, checkpoint=checkpoint)
+    assert checkpoint.done('sync/site1_grass_dt.csv')
+
+    # The run failed later on and is started again, the failed file is reported from its checkpoint
+    (tmp_path / 'site' / 'site1_grass_dt.csv').write_text(CSV)
+    resumed = Checkpoint('2024-06-12', directory=str(tmp_path / 'checkpoints'))
+    statuses = sync_logger_files(http, listed(server), {'files': {}, 'sites': {}}, checkpoint=resumed)
+    http.close()
+    assert statuses['site1_grass_dt.csv'].startswith('error: 404')
+    assert statuses['site0_grass_dt.csv'] == 'downloaded'
@@ -0,0 +1,144 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+TRACE_DIR = 'data/traces'
+
+# Trace (and profile) files kept in TRACE_DIR, the oldest are deleted
+MAX_TRACES = 200
+
+
+class Trace:
+    """
+    Durations of the stages of one run, plus per-URL and per-sensor events.
+
+    Stages nest (get_reports/summary/metrics), events can be recorded from worker threads. A run starts with
+    start() and is written as JSON with write().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self, name='run'):
+        with self._lock:
+            self.name = name
+            self.started = datetime.now()
+            self._t0 = time.perf_counter()
+            self._stack = []
+            self._lap = None
+            self.stages = []
+            self.events = []
+
+    @contextmanager
+    def stage(self, name, **attrs):
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield attrs  # The stage can add counts (rows, files, ...) to attrs while it runs
+        finally:
+            self._stack.pop()
+            self._record(path, start, attrs)
+
+    def lap(self, name=None, **attrs):
+        """End the running lap (if any) and start the next one, for stages that follow each other in one function"""
+        now = time.perf_counter()
+        if self._lap is not None:
+            self._record(*self._lap)
+        self._lap = ('/'.join(self._stack + [name]), now, attrs) if name else None
+
+    def _record(self, path, start, attrs):
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.stages.append({'name': path, 'start': round(start - self._t0, 4), 'duration': round(duration, 4), **attrs})
+        print(f"[timing] {path}: {duration:.2f} s")
+
+    def event(self, kind, name, duration, **attrs):
+        with self._lock:
+            self.events.append({'kind': kind, 'name': name, 'duration': round(duration, 4), **attrs})
+
+    def summary(self):
+        # Totals per kind of event, e.g. the number of requests, their time and bytes
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['kind'], {'count': 0, 'duration': 0.0})
+            total['count'] += 1
+            total['duration'] = round(total['duration'] + event['duration'], 4)
+            for key in ('bytes', 'rows', 'saved_bytes'):
+                if key in event:
+                    total[key] = total.get(key, 0) + event[key]
+        return totals
+
+    def write(self, trace_dir=TRACE_DIR):
+        """Write the run to trace_dir/<name>-<timestamp>.json, returns the path"""
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{self.name}-{self.started.strftime('%Y%m%d-%H%M%S')}.json")
+        with self._lock:
+            trace = {
+                'name': self.name,
+                'started': self.started.isoformat(),
+                'duration': round(time.perf_counter() - self._t0, 4),
+                'stages': sorted(self.stages, key=lambda x: x['start']),
+                'summary': self.summary(),
+                'events': self.events
+            }
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=2, default=str)
+        _evict(trace_dir)
+        print(f"Trace written to {path}")
+        return path
+
+
+def _evict(trace_dir, max_traces=MAX_TRACES):
+    paths = sorted((os.path.join(trace_dir, x) for x in os.listdir(trace_dir)), key=os.path.getmtime)
+    for path in paths[:-max_traces]:
+        os.remove(path)
+
+
+# The trace of the running process, every module records into it
+TRACE = Trace()
+stage = TRACE.stage
+lap = TRACE.lap
+event = TRACE.event
+
+
+@contextmanager
+def profiled(name, profiler=None, trace_dir=TRACE_DIR):
+    """
+    Profile the block with cProfile ('cprofile') or pyinstrument ('pyinstrument'), nothing when profiler is falsy.
+
+    The profile is written next to the traces, as <name>-<timestamp>.prof (cProfile, open with pstats or snakeviz)
+    or .html (pyinstrument).
+    """
+    if not profiler:
+        yield
+        return
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(f"{path}.html", 'w') as f:
+                f.write(profile.output_html())
+            print(f"Profile written to {path}.html")
+    else:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(f"{path}.prof")
+            print(f"Profile written to {path}.prof")
@@ -1,40 +1,10 @@
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.utils import COMMASPACE, formatdate
-from email import encoders
-import smtplib
 from fpdf import FPDF
-from os.path import basename
+from mailer import DEFAULT_MAX_ATTACHMENT_MB, get_mailer
 
 
-# The email function we copy pasted from stackoverflow
-def send_mail(send_from, send_to, subject, text, files=None, server="localhost"):
-    msg = MIMEMultipart()
-    
-    msg['From'] = send_from
-    msg['To'] = COMMASPACE.join(send_to)
-    msg['Date'] = formatdate(localtime=True)
-    msg['Subject'] = subject
-    
-    msg_content = MIMEText(text)
-    msg.attach(msg_content)
-    
-    for f in files or []:
-        with open(f, "rb") as fil:
-            part = MIMEApplication(
-                fil.read(),
-                Name=basename(f)
-            )
-        # After the file is closed
-        part['Content-Disposition'] = 'attachment; filename="%s"' % basename(f)
-        msg.attach(part)
-
-    smtp = smtplib.SMTP(server)
-    smtp.sendmail(send_from, send_to, msg.as_string())
-    
-    smtp.close()
+# Every message to a server goes over one reused SMTP session and is streamed to it, see mailer.py
+def send_mail(send_from, send_to, subject, text, files=None, server="localhost", max_attachment_mb=DEFAULT_MAX_ATTACHMENT_MB, link_url=None):
+    get_mailer(server).send(send_from, send_to, subject, text, files, max_attachment_mb, link_url)
 
 class PDF(FPDF):
     def header(self):
@@ -63,6 +33,8 @@ class PDF(FPDF):
         self.ln(10)
         
 def determine_status(row):
+    if isinstance(row.get('error'), str):
+        return f"{row['sensor_type']}: ERROR '{row['error']}'"
     if row['last_updated_status'] == 'NO':
         return f"{row['sensor_type']}: Updated Within 24 Hours 'NO'. Last Updated '{row['last_updated_entry']}'"
     elif 'UNAVAILABLE' in row['sensor_type']:
@@ -75,7 +47,10 @@ def determine_status(row):
         else:
             battery = f"Battery '{row.get('battery_status', 'Not Applicable').replace('.0','')}'"
             missing_data = ''
-            hq_images = f"HQ Images '{str(row.get('percent_hq_images', 'nan')).replace('.0', '')}%'. Max Image Size: {row.get('max_image_size')} (kb)" if 'percent_hq_images' in row else ''
+            windows = [x for x in row.index if x.startswith('percent_hq_images_')]
+            trend = ', '.join(f"last {x[len('percent_hq_images_'):]} '{str(row[x]).replace('.0', '')}%'" for x in windows)
+            trend = f" ({trend})" if trend else ''
+            hq_images = f"HQ Images '{str(row.get('percent_hq_images', 'nan')).replace('.0', '')}%'{trend}. Max Image Size: {row.get('max_image_size')} (kb)" if 'percent_hq_images' in row else ''
 
         updated_today = f"Updated Within 24 Hours 'Yes'" if row['last_updated_status'] == 'YES' else f"Updated Within 24 Hours 'NO'"
         last_entry = f"Last Updated '{row['last_updated_entry']}', " if row['last_updated_status'] == 'NO' else ""